@@ -100,11 +100,8 @@ class BootLogoViewer(QLabel):
             bios_content = bytearray(bios_file.read())
 
         offset = tadpole_functions.findSequence(tadpole_functions.offset_logo_presequence, bios_content) + 16
-        # TODO switch this to be in memory
-        with open(os.path.join(self.basedir, "bios_image.raw"), "wb") as image_file:
-            image_file.write(bios_content[offset:offset+((512*200)*2)])
-
-        self.load_image(os.path.join(self.basedir, "bios_image.raw"))
+        img = tadpole_functions.RGB565toQImage(memoryview(bios_content)[offset:offset+((512*200)*2)], 512, 200)
+        self.setPixmap(QPixmap().fromImage(img))
 
     def load_image(self, path: str) -> bool:
         """
@@ -119,8 +116,7 @@ class BootLogoViewer(QLabel):
             bool: True if image was loaded, False if not.
         """
         if os.path.splitext(path)[1] == ".raw":  # if raw image, assume RGB16 (RGB565 Little Endian)
-            with open(path, "rb") as f:
-                img = QImage(f.read(), 512, 200, QImage.Format_RGB16)
+            img = tadpole_functions.readRGB565QImage(path, 512, 200)
         else:  # otherwise let QImage autodetection do its thing
             img = QImage(path)
             if (img.width(), img.height()) != (512, 200): 
@@ -67,13 +67,12 @@ by matching the name of the game and a folder you select?  You can change the ic
         if ret == qm.Yes:
             directory = QFileDialog.getExistingDirectory()
             if len(directory) > 0:  # confirm if user selected a file
+                icon_files = frogtool.drive_index.entries(directory)
                 for i, gameName in enumerate(self.game_shortcut_list):
                     gameName = os.path.basename(gameName)
-                    for file in os.listdir(directory):
-                        file_stripped = frogtool.strip_file_extension(file)
-                        if gameName == file_stripped:
-                            gameIcon = os.path.join(directory, file)
-                            self.ovewrite_background_and_reload(gameIcon, i+1)
+                    for file in icon_files:
+                        if gameName == file.stem:
+                            self.ovewrite_background_and_reload(file.path, i+1)
                             continue
 
         # Setup Main Layout
@@ -174,36 +173,30 @@ by matching the name of the game and a folder you select?  You can change the ic
         game = new_image.resize((120, 120), Image.Resampling.NEAREST)
 
         # Create rectangles for white borders with fillet
-        white_rounded_rect = self.round_rectangle((124,124), 8, "white")
-
+        white_rounded_rect, outline_mask, border_mask = self.shortcut_masks()
+        white_rounded_rect = white_rounded_rect.copy()
         white_rounded_rect.paste(game, (2,2))
-        game = white_rounded_rect
-
-        white_rounded_rect2 = self.round_rectangle((124,124), 8, "white")
-        black_rounded_rect2 = self.round_rectangle((120,120), 8, "black")
-        white_rounded_rect2.paste(black_rounded_rect2, (2,2), black_rounded_rect2)
-
-        datas = white_rounded_rect2.getdata()
-
-        img_data = white_rounded_rect.getdata()
 
-        newData = []
-        new_imgData = []
-        for idx,item in enumerate(datas):
-            if item[3] == 0:
-                new_imgData.append((255, 255, 255, 0))
-            else:
-                new_imgData.append(img_data[idx])
-
-            if item[0] == 0 and item[1] == 0 and item[2] == 0:
-                newData.append((255, 255, 255, 0))
-            else:
-                newData.append(item)
+        # Cut the icon to the rounded outline, then draw the white border over it
+        icon = Image.new('RGBA', (124, 124), (255, 255, 255, 0))
+        icon.paste(white_rounded_rect, (0, 0), outline_mask)
+        icon.paste((255, 255, 255, 255), (0, 0, 124, 124), border_mask)
+        return icon
+    
+    # The rounded outline and border are the same for every icon, so they are only drawn once
+    _shortcutMasks = None
 
-        white_rounded_rect2.putdata(newData)
-        game.putdata(new_imgData)
-        game.paste(white_rounded_rect2, (0,0), white_rounded_rect2)
-        return game
+    def shortcut_masks(self):
+        if GameShortcutIconsDialog._shortcutMasks is None:
+            white_rounded_rect = self.round_rectangle((124,124), 8, "white")
+            white_rounded_rect2 = self.round_rectangle((124,124), 8, "white")
+            black_rounded_rect2 = self.round_rectangle((120,120), 8, "black")
+            white_rounded_rect2.paste(black_rounded_rect2, (2,2), black_rounded_rect2)
+            # the outline is everything drawn, the border is the white ring left around the black inside
+            outline_mask = white_rounded_rect2.getchannel('A')
+            border_mask = white_rounded_rect2.convert('L')
+            GameShortcutIconsDialog._shortcutMasks = (white_rounded_rect, outline_mask, border_mask)
+        return GameShortcutIconsDialog._shortcutMasks
     
     def ovewrite_background_and_reload(self, path, icon):
         #Following techniques by Zerter at view-source:https://zerter555.github.io/sf2000-collection/mainMenuIcoEditor.html
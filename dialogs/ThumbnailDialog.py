@@ -6,6 +6,7 @@ from PyQt5.QtCore import Qt, QTimer, QUrl, QSize
 # OS imports - these should probably be moved somewhere else
 import os
 import tadpole_functions
+import frogtool
 
 # Subclass Qidget to create a thumbnail viewing window        
 class ThumbnailDialog(QDialog):
@@ -30,9 +31,7 @@ class ThumbnailDialog(QDialog):
 
         # Load Initial Image
         # If it's a supported .z**, open it, otherwise leave it blank
-        file_extension = file_extension = os.path.splitext(filepath)[1]
-        if file_extension == '.zfb' or file_extension == '.zfc' or file_extension == '.zgb' or \
-                                    file_extension == '.zmd' or file_extension == '.zsf': 
+        if "zxx" in frogtool.classify_file(os.path.basename(filepath)):
             self.current_viewer.load_from_ROM_inMemory(filepath)
 
         self.layout_main.addWidget(QLabel(" "))  # spacer
@@ -127,9 +126,7 @@ class ROMCoverViewer(QLabel):
         basedir = os.path.dirname(__file__)
         print(f"loading cover from {pathToROM}")
         self.path = pathToROM  # update path
-        with open(pathToROM, "rb") as rom_file:
-            rom_content = bytearray(rom_file.read((144*208)*2))
-        img = QImage(rom_content[0:((144*208)*2)], 144, 208, QImage.Format_RGB16)
+        img = tadpole_functions.readZXXThumbnailQImage(pathToROM)
         self.setPixmap(QPixmap().fromImage(img))
         print("Successfully pulled thumbnail in memory")
         if self.changeable:  # only enable saving for changeable dialogs; prevents enabling with load from bios
@@ -150,8 +147,7 @@ class ROMCoverViewer(QLabel):
             bool: True if image was loaded, False if not.
         """
         if os.path.splitext(path)[1] == ".raw":  # if raw image, assume RGB16 (RGB565 Little Endian)
-            with open(path, "rb") as f:
-                img = QImage(f.read(), 144, 208, QImage.Format_RGB16)
+            img = tadpole_functions.readRGB565QImage(path)
         else:  # otherwise let QImage autodetection do its thing
             img = QImage(path)
             if (img.width(), img.height()) != (144, 208): 
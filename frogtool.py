@@ -1,16 +1,35 @@
 import os
-import re
-import binascii
 import shutil
 import struct
+import json
+import math
+import hashlib
+import io
+import bisect
+import time
+import sys
+import argparse
+import contextlib
+import mmap
+import tarfile
+import tempfile
+import zipfile
+import threading
+import multiprocessing
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 
 try:
     from PIL import Image
     from PIL import ImageDraw
+    from PIL import ImageChops
     image_lib_avail = True
 except ImportError:
     Image = None
     ImageDraw = None
+    ImageChops = None
     image_lib_avail = False
 
 systems = {
@@ -36,8 +55,14 @@ supported_img_ext = [
 supported_zip_ext = [
     "bkp", "zip"
 ]
+supported_save_ext = [
+    "sav", "sa0", "sa1", "sa2", "sa3"
+]
 
 defaultThumbnailSize = (144, 208)
+thumbnail_data_size = defaultThumbnailSize[0] * defaultThumbnailSize[1] * 2
+zfb_separator = b"\x00\x00\x00\x00"
+zfb_terminator = b"\x00\x00"
 
 
 class StopExecution(Exception):
@@ -45,29 +70,65 @@ class StopExecution(Exception):
 
 
 def int_to_4_bytes_reverse(src_int):
-    hex_string = format(src_int, "x").rjust(8, "0")[0:8]
-    return binascii.unhexlify(hex_string)[::-1]  # reverse it
+    return struct.pack("<I", src_int)
 
 
 def file_entry_to_name(file_entry):
     return file_entry.name
 
 
-def check_file(file_entry, supported_exts):
-    file_regex = ".+\\.(" + "|".join(supported_exts) + ")$"
-    return file_entry.is_file() and re.search(file_regex, file_entry.name.lower())
+def zxx_category(system):
+    return "zxx_" + system
+
+
+def build_ext_categories():
+    # maps a lowercase extension to every category it belongs to, so a file is classified with a single dict lookup
+    categories = {}
+    category_exts = [
+        ("rom", supported_rom_ext),
+        ("image", supported_img_ext),
+        ("zip", supported_zip_ext),
+        ("zxx", zxx_ext.values()),
+        ("save", supported_save_ext)
+    ]
+    category_exts += [(zxx_category(system), [ext]) for system, ext in zxx_ext.items()]
+    for category, exts in category_exts:
+        for ext in exts:
+            categories.setdefault(ext, set()).add(category)
+    return {ext: frozenset(ext_set) for ext, ext_set in categories.items()}
+
+
+ext_categories = build_ext_categories()
+no_categories = frozenset()
+
+
+def get_file_ext(name):
+    stem, dot, ext = name.rpartition(".")
+    if not dot or not stem:
+        return ""
+    return ext.lower()
+
+
+def classify_file(name):
+    return ext_categories.get(get_file_ext(name), no_categories)
+
+
+def check_file(file_entry, category):
+    if isinstance(file_entry, (DriveIndexEntry, ArchiveImage)):
+        return category in file_entry.categories
+    return file_entry.is_file() and category in classify_file(file_entry.name)
 
 
 def check_rom(file_entry):
-    return check_file(file_entry, supported_rom_ext)
+    return check_file(file_entry, "rom")
 
 
 def check_img(file_entry):
-    return check_file(file_entry, supported_img_ext)
+    return check_file(file_entry, "image")
 
 
 def check_zip(file_entry):
-    return check_file(file_entry, supported_zip_ext)
+    return check_file(file_entry, "zip")
 
 
 def strip_file_extension(name):
@@ -86,25 +147,291 @@ def sort_without_file_ext(unsorted_list):
     return sorted(sort_map, key=sort_map.get)
 
 
-def getROMList(roms_path):
+class DriveIndexEntry:
+    """A file from a DriveIndex snapshot, with the stat results, name parts and extension class worked out once"""
+    __slots__ = ("name", "path", "size", "mtime_ns", "stem", "ext", "categories")
+
+    def __init__(self, dir_entry):
+        stat = dir_entry.stat()
+        self.name = dir_entry.name
+        self.path = dir_entry.path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.ext = get_file_ext(self.name)
+        self.stem = self.name[:-len(self.ext) - 1] if self.ext else self.name
+        self.categories = ext_categories.get(self.ext, no_categories)
+
+    def is_file(self):
+        # only files are kept in a snapshot, this keeps entries interchangeable with os.DirEntry
+        return True
+
+
+class DriveIndex:
+    """
+    Keeps one os.scandir snapshot per folder so the same folder isn't enumerated again for every step of an operation.
+    A snapshot is dropped when the folder's modified time changes, when it gets older than max_age_seconds (some
+    filesystems don't update folder times when files change) or when invalidate() is called after changing a folder.
+    """
+    # FAT only stores modified times to the nearest 2 seconds, a change inside that window won't move the folder time
+    mtime_resolution_ns = 2000000000
+    max_age_seconds = 30
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(folder_path):
+        return os.path.normcase(os.path.abspath(folder_path))
+
+    def entries(self, folder_path):
+        key = self._key(folder_path)
+        folder_mtime_ns = os.stat(folder_path).st_mtime_ns
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+        if snapshot:
+            taken_ns, snapshot_mtime_ns, entries = snapshot
+            if (snapshot_mtime_ns == folder_mtime_ns
+                    and taken_ns - folder_mtime_ns > self.mtime_resolution_ns
+                    and time.time_ns() - taken_ns < self.max_age_seconds * 1000000000):
+                return entries
+        taken_ns = time.time_ns()
+        with os.scandir(folder_path) as dir_entries:
+            entries = [DriveIndexEntry(dir_entry) for dir_entry in dir_entries if dir_entry.is_file()]
+        with self._lock:
+            self._snapshots[key] = (taken_ns, folder_mtime_ns, entries)
+        return entries
+
+    def invalidate(self, folder_path=None):
+        with self._lock:
+            if folder_path is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(self._key(folder_path), None)
+
+    def invalidate_file(self, file_path):
+        self.invalidate(os.path.dirname(file_path) or ".")
+
+
+drive_index = DriveIndex()
+
+
+class ArchiveImage:
+    """
+    An image inside a zip or tar archive, listed like a DriveIndexEntry so it can be matched to ROMs by name and read
+    straight out of the archive without extracting it. It only holds names and offsets so it can be sent to a worker.
+    """
+    __slots__ = ("archive_path", "member", "name", "path", "size", "stem", "ext", "categories")
+
+    def __init__(self, archive_path, member, member_name, size):
+        self.archive_path = archive_path
+        # the zip member name, or the TarInfo so a tar member can be found again without listing the archive
+        self.member = member
+        self.name = member_name.rstrip("/").rsplit("/", 1)[-1]
+        self.path = f"{archive_path}/{member_name}"
+        self.size = size
+        self.ext = get_file_ext(self.name)
+        self.stem = self.name[:-len(self.ext) - 1] if self.ext else self.name
+        self.categories = ext_categories.get(self.ext, no_categories)
+
+    def __str__(self):
+        return self.path
+
+    def is_file(self):
+        return True
+
+    def read(self):
+        global open_archives_last_read
+        with open_archives_lock:
+            archive = open_archives.get(self.archive_path)
+            if archive is None:
+                if isinstance(self.member, tarfile.TarInfo):
+                    archive = tarfile.open(self.archive_path, "r:")
+                else:
+                    archive = zipfile.ZipFile(self.archive_path)
+                open_archives[self.archive_path] = archive
+            open_archives_last_read = time.monotonic()
+            start_close_archives_timer(archive_idle_seconds)
+            if isinstance(archive, tarfile.TarFile):
+                member_file = archive.extractfile(self.member)
+                if member_file is None:
+                    raise OSError(f"{self.path} is not a file")
+                with member_file:
+                    return member_file.read()
+            return archive.read(self.member)
+
+
+# archives opened by ArchiveImage.read, kept open while a batch reads many images from them. Worker processes outlive
+# the batch and are never told it has ended, so an archive is also closed once nothing has read from it for a while
+# (on Windows the archive can't be moved or deleted while it is open)
+open_archives = {}
+open_archives_lock = threading.Lock()
+open_archives_last_read = 0
+open_archives_timer = None
+archive_idle_seconds = 2
+
+
+def start_close_archives_timer(delay):
+    # called with open_archives_lock held
+    global open_archives_timer
+    if open_archives_timer is None:
+        open_archives_timer = threading.Timer(delay, close_idle_archives)
+        open_archives_timer.daemon = True
+        open_archives_timer.start()
+
+
+def close_idle_archives():
+    global open_archives_timer
+    with open_archives_lock:
+        open_archives_timer = None
+        idle = time.monotonic() - open_archives_last_read
+        if idle < archive_idle_seconds:
+            start_close_archives_timer(archive_idle_seconds - idle)
+            return
+    close_archives()
+
+
+def close_archives():
+    global open_archives_timer
+    with open_archives_lock:
+        if open_archives_timer is not None:
+            open_archives_timer.cancel()
+            open_archives_timer = None
+        for archive in open_archives.values():
+            archive.close()
+        open_archives.clear()
+
+
+def list_archive_images(archive_path):
+    """
+    Lists the images in a zip or uncompressed tar archive from its member list, without extracting anything.
+    Folders inside the archive are ignored, images are matched by their own filename.
+    """
+    images = []
+    try:
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        images.append(ArchiveImage(archive_path, info.filename, info.filename, info.file_size))
+        elif tarfile.is_tarfile(archive_path):
+            # images are read in ROM order by several workers at once, each read from a compressed tar would
+            # decompress it again from the start
+            try:
+                archive = tarfile.open(archive_path, "r:")
+            except tarfile.ReadError:
+                print(f"! {archive_path} is a compressed tar, extract it first or use a zip or uncompressed tar")
+                return images
+            with archive:
+                for info in archive:
+                    if info.isfile():
+                        images.append(ArchiveImage(archive_path, info, info.name, info.size))
+        else:
+            print(f"! {archive_path} is not a zip or tar archive")
+            return images
+    except (OSError, zipfile.BadZipFile, tarfile.TarError) as error:
+        print(f"! Failed reading archive {archive_path}. {error}")
+        return []
+    return list(filter(check_img, images))
+
+
+def list_thumbnail_images(source_path):
+    """Lists the images in a folder, or in a zip or tar archive of images"""
+    if os.path.isdir(source_path):
+        return list(filter(check_img, drive_index.entries(source_path)))
+    return list_archive_images(source_path)
+
+
+def thumbnail_source(img_file):
+    # what encode_thumbnail_file needs to read an image from a folder listing or an archive listing
+    return img_file if isinstance(img_file, ArchiveImage) else img_file.path
+
+
+def read_thumbnail_source(src):
+    if isinstance(src, ArchiveImage):
+        return src.read()
+    with open(src, "rb") as src_file:
+        return src_file.read()
+
+
+def getROMEntries(roms_path):
     if not os.path.isdir(roms_path):
         print(f"! Couldn't find folder {roms_path}")
         print("  Check the provided path points to an SF2000 SD card!")
         raise StopExecution
-    files = os.scandir(roms_path)
-    files = list(filter(check_rom, files))
-    filenames = list(map(file_entry_to_name, files))
-    return filenames
+    return list(filter(check_rom, drive_index.entries(roms_path)))
+
+
+def getROMList(roms_path):
+    return list(map(file_entry_to_name, getROMEntries(roms_path)))
+
+
+def get_fingerprint_path(index_path_files):
+    return f"{index_path_files}_fingerprint"
+
+
+def build_rom_fingerprint(rom_entries):
+    # the name, size and modified time of every ROM is enough to tell if the folder changed since the last rebuild
+    fingerprint = {}
+    for entry in rom_entries:
+        fingerprint[entry.name] = [entry.size, entry.mtime_ns]
+    return dict(sorted(fingerprint.items()))
+
+
+def hash_index_files(index_paths):
+    index_hashes = {}
+    for index_path in index_paths:
+        with open(index_path, 'rb') as file_handle:
+            index_hashes[os.path.basename(index_path)] = hashlib.sha1(file_handle.read()).hexdigest()
+    return index_hashes
+
+
+def check_fingerprint(fingerprint_path, rom_fingerprint, index_paths):
+    try:
+        with open(fingerprint_path, 'r', encoding='utf-8') as file_handle:
+            stored = json.load(file_handle)
+        return stored["roms"] == rom_fingerprint and stored["indexes"] == hash_index_files(index_paths)
+    except (OSError, IOError, ValueError, KeyError, TypeError):
+        return False
+
+
+def write_fingerprint(fingerprint_path, rom_fingerprint, index_paths):
+    try:
+        fingerprint = {"roms": rom_fingerprint, "indexes": hash_index_files(index_paths)}
+        with open(fingerprint_path, 'w', encoding='utf-8') as file_handle:
+            json.dump(fingerprint, file_handle)
+    except (OSError, IOError):
+        # not fatal, the next rebuild just won't be skipped
+        print(f"! Failed writing fingerprint file {fingerprint_path}")
+
 
 def process_sys(drive, system, test_mode):
+    rebuild = prepare_sys(drive, system, test_mode)
+    return commit_sys(rebuild, test_mode)
+
+
+def prepare_sys(drive, system, test_mode):
+    """
+    Scans a system folder, converts any zip + image pairs and builds the contents of its three index files.
+    Nothing in Resources is written here, that is left to commit_sys so the writes can be kept together.
+    """
     print(f"Processing {system}")
 
     roms_path = os.path.join(drive,system)
-    filenames = getROMList(roms_path)
+    if not os.path.isdir(roms_path):
+        print(f"! Couldn't find folder {roms_path}")
+        print("  Check the provided path points to an SF2000 SD card!")
+        raise StopExecution
+
+    # a rebuild is the authoritative rescan, a cached snapshot can miss files copied in the last few seconds
+    drive_index.invalidate(roms_path)
+    if not test_mode:
+        recover_zxx_thumbnails(roms_path)
 
     index_path_files = os.path.join(drive,"Resources",systems[system][0])
     index_path_cn = os.path.join(drive,"Resources",systems[system][1])
     index_path_pinyin = os.path.join(drive,"Resources",systems[system][2])
+    index_paths = [index_path_files, index_path_cn, index_path_pinyin]
     check_and_back_up_file(index_path_files)
     check_and_back_up_file(index_path_cn)
     check_and_back_up_file(index_path_pinyin)
@@ -115,12 +442,105 @@ def process_sys(drive, system, test_mode):
         convert_zip_image_pairs_to_zxx(roms_path, system)
 
     #Bugfix: get new filenames now that we have converted from zip to zxx
-    filenames = getROMList(roms_path)
-    no_files = len(filenames)
-    if no_files == 0:
+    rom_entries = getROMEntries(roms_path)
+    filenames = list(map(file_entry_to_name, rom_entries))
+
+    rebuild = {
+        "system": system,
+        "index_paths": index_paths,
+        "filenames": filenames,
+        "fingerprint_path": get_fingerprint_path(index_path_files),
+        "rom_fingerprint": build_rom_fingerprint(rom_entries),
+        "up_to_date": False,
+        "index_contents": None
+    }
+    # skip rewriting the indexes if nothing changed in the folder and the indexes on the card are the ones we wrote
+    if not test_mode and check_fingerprint(rebuild["fingerprint_path"], rebuild["rom_fingerprint"], index_paths):
+        rebuild["up_to_date"] = True
+        return rebuild
+
+    if not filenames:
         print("No ROMs found! Going to save an empty file list")
         #return f"No ROMs found to rebuild in {system}"
+    rebuild["index_contents"] = build_sys_indexes(filenames)
+    return rebuild
+
+
+def commit_sys(rebuild, test_mode):
+    system = rebuild["system"]
+    no_files = len(rebuild["filenames"])
+    if rebuild["up_to_date"]:
+        print(f"No changes to {system} since the last rebuild, skipping\n")
+        return f"{system} is already up to date with {no_files} ROMs"
+
+    write_index_contents(rebuild["index_contents"], rebuild["index_paths"], test_mode)
+
+    # the fingerprint goes last so it only ever describes lists that made it onto the card
+    if not test_mode:
+        write_fingerprint(rebuild["fingerprint_path"], rebuild["rom_fingerprint"], rebuild["index_paths"])
+
+    print(f"Done {system}\n")
+    return f"Finished updating {system} with {no_files} ROMs"
+
+
+def process_all_sys(drive, test_mode, progress_callback=None, max_workers=None):
+    """
+    Rebuilds every system at once. The folders are scanned and converted in a pool of worker threads, and each
+    system's index files are written from this thread as soon as it is ready, so only one system writes at a time.
+    progress_callback is called from this thread with each result as it completes.
+    Returns a dict of system to result, where each result has the ROM count, message and timings for that system.
+    """
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(systems)) as executor:
+        futures = {executor.submit(timed_prepare_sys, drive, system, test_mode): system for system in systems}
+        for future in as_completed(futures):
+            system = futures[future]
+            result = new_sys_result(system)
+            try:
+                rebuild, result["scan_seconds"] = future.result()
+                timed_commit_sys(rebuild, test_mode, result)
+            except StopExecution:
+                result["error"] = f"Failed updating {system}"
+                result["message"] = result["error"]
+            results[system] = result
+            if progress_callback:
+                progress_callback(result, len(results), len(systems))
+    return results
+
+
+def process_sys_timed(drive, system, test_mode):
+    """Rebuilds one system like process_sys, returning the same result dict as process_all_sys"""
+    result = new_sys_result(system)
+    try:
+        rebuild, result["scan_seconds"] = timed_prepare_sys(drive, system, test_mode)
+        timed_commit_sys(rebuild, test_mode, result)
+    except StopExecution:
+        result["error"] = f"Failed updating {system}"
+        result["message"] = result["error"]
+    return result
+
+
+def new_sys_result(system):
+    return {"system": system, "roms": 0, "skipped": False, "error": None,
+            "message": "", "scan_seconds": 0.0, "write_seconds": 0.0}
+
+
+def timed_prepare_sys(drive, system, test_mode):
+    start_time = time.perf_counter()
+    rebuild = prepare_sys(drive, system, test_mode)
+    return rebuild, time.perf_counter() - start_time
+
+
+def timed_commit_sys(rebuild, test_mode, result):
+    start_time = time.perf_counter()
+    result["message"] = commit_sys(rebuild, test_mode)
+    result["write_seconds"] = time.perf_counter() - start_time
+    result["roms"] = len(rebuild["filenames"])
+    result["skipped"] = rebuild["up_to_date"]
+
 
+def build_sys_indexes(filenames):
     stripped_names = list(map(strip_file_extension, filenames))
 
     # prepare maps of filenames to index name for the 3 index files
@@ -131,69 +551,298 @@ def process_sys(drive, system, test_mode):
     name_map_cn = dict(zip(filenames, stripped_names))
     name_map_pinyin = dict(zip(filenames, stripped_names))
 
-    write_index_file(name_map_files, sort_without_file_ext, index_path_files, test_mode)
-    write_index_file(name_map_cn, sort_normal, index_path_cn, test_mode)
-    write_index_file(name_map_pinyin, sort_normal, index_path_pinyin, test_mode)
+    return [
+        build_index_content(name_map_files, sort_without_file_ext),
+        build_index_content(name_map_cn, sort_normal),
+        build_index_content(name_map_pinyin, sort_normal)
+    ]
+
+
+def write_sys_indexes(filenames, index_paths, test_mode):
+    write_index_contents(build_sys_indexes(filenames), index_paths, test_mode)
+
+
+class IndexFile:
+    """
+    Read only view of a .tax/.nec/.bvs game list, either memory mapped from the card or over an in-memory buffer.
+    count is the number of games, pointers are the name offsets in display order and name_offsets are the offsets of
+    every name in the order they are stored. Names are only decoded when asked for.
+    """
+    def __init__(self, buffer, index_path=""):
+        self.index_path = index_path
+        self.buffer = buffer
+        self._mmap = None
+        if len(buffer) < 4:
+            if len(buffer):
+                raise ValueError(f"Index {index_path} is truncated")
+            self.count = 0
+            self.pointers = array('I')
+            self.name_offsets = array('I')
+            self.names_start = 4
+            return
+        self.count = struct.unpack_from("<I", buffer, 0)[0]
+        self.names_start = 4 * (self.count + 1)
+        if self.names_start > len(buffer):
+            raise ValueError(f"Index {index_path} is truncated")
+        self.pointers = array('I', buffer[4:self.names_start])
+        if sys.byteorder == "big":
+            self.pointers.byteswap()
+        self.name_offsets = array('I')
+        name_start = self.names_start
+        for _ in range(self.count):
+            name_end = buffer.find(b"\0", name_start)
+            if name_end == -1:
+                raise ValueError(f"Index {index_path} is truncated")
+            self.name_offsets.append(name_start - self.names_start)
+            name_start = name_end + 1
+
+    @classmethod
+    def open(cls, index_path):
+        with open(index_path, 'rb') as file_handle:
+            if os.fstat(file_handle.fileno()).st_size == 0:
+                return cls(b"", index_path)
+            index_mmap = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        index_file = cls(index_mmap, index_path)
+        index_file._mmap = index_mmap
+        return index_file
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def name_at(self, pointer):
+        name_start = self.names_start + pointer
+        name_end = self.buffer.find(b"\0", name_start)
+        if name_end == -1:
+            raise ValueError(f"Index {self.index_path} has a pointer past the end of the names")
+        return self.buffer[name_start:name_end].decode('utf-8', errors='replace')
+
+    def stored_names(self):
+        return [self.name_at(offset) for offset in self.name_offsets]
+
+    def display_names(self):
+        return [self.name_at(pointer) for pointer in self.pointers]
+
+    def matches(self, index_content):
+        return memoryview(self.buffer) == index_content
+
+
+def number_repeated_names(names):
+    # (name, n) for the nth time a name appears, as a .nec or .bvs list shows Game.zip and Game.zgb both as Game
+    seen = Counter()
+    numbered = []
+    for name in names:
+        numbered.append((name, seen[name]))
+        seen[name] += 1
+    return numbered
+
+
+def find_reordered_names(existing_names, fresh_names):
+    # the smallest set of entries that moved is everything outside the longest run that kept its relative order
+    fresh_positions = {name: position for position, name in enumerate(fresh_names)}
+    positions = [fresh_positions[name] for name in existing_names]
+    tails = []
+    tail_indexes = []
+    previous = [-1] * len(positions)
+    for i, position in enumerate(positions):
+        tail = bisect.bisect_left(tails, position)
+        if tail == len(tails):
+            tails.append(position)
+            tail_indexes.append(i)
+        else:
+            tails[tail] = position
+            tail_indexes[tail] = i
+        previous[i] = tail_indexes[tail - 1] if tail else -1
+    in_order = set()
+    i = tail_indexes[-1] if tail_indexes else -1
+    while i != -1:
+        in_order.add(i)
+        i = previous[i]
+    return [name for i, name in enumerate(existing_names) if i not in in_order]
+
+
+def diff_index(existing_index, fresh_index):
+    """
+    Compares an existing IndexFile against a freshly computed one.
+    Returns a dict listing the display names that are missing from the existing index, the extra ones it has that
+    shouldn't be there and the ones that are in a different display order.
+    """
+    existing_names = existing_index.display_names()
+    fresh_names = fresh_index.display_names()
+    existing_counts = Counter(existing_names)
+    fresh_counts = Counter(fresh_names)
+    # a name can be listed more than once, so each time it appears is matched up separately
+    existing_numbered = number_repeated_names(existing_names)
+    fresh_numbered = number_repeated_names(fresh_names)
+    in_both = set(existing_numbered) & set(fresh_numbered)
+    reordered = find_reordered_names([entry for entry in existing_numbered if entry in in_both],
+                                     [entry for entry in fresh_numbered if entry in in_both])
+    return {
+        "path": existing_index.index_path,
+        "matches": existing_index.matches(fresh_index.buffer),
+        "existing_count": existing_index.count,
+        "fresh_count": fresh_index.count,
+        "missing": list((fresh_counts - existing_counts).elements()),
+        "extra": list((existing_counts - fresh_counts).elements()),
+        "reordered": [name for name, occurrence in reordered]
+    }
+
+
+def check_index_content(new_index_content, index_path):
+    with IndexFile.open(index_path) as existing_index:
+        return diff_index(existing_index, IndexFile(new_index_content))
+
+
+def audit_sys(drive, system):
+    """Diffs the game lists on the card against the folder contents without converting or writing anything"""
+    roms_path = os.path.join(drive, system)
+    drive_index.invalidate(roms_path)
+    filenames = getROMList(roms_path)
+    index_paths = [os.path.join(drive, "Resources", index_file) for index_file in systems[system]]
+    return [check_index_content(new_index_content, index_path)
+            for new_index_content, index_path in zip(build_sys_indexes(filenames), index_paths)]
+
+
+def read_index_filenames(index_path_files):
+    # the names in the "files" index should be stored in alphabetised filename order, but update_sys_index bisects
+    # the list so sort it anyway in case another tool wrote it
+    with IndexFile.open(index_path_files) as index_file:
+        return sorted(index_file.stored_names())
+
+
+def update_sys_index(drive, system, added=(), removed=(), renamed=(), test_mode=False):
+    """
+    Applies a batch of changes to the game lists of one system without rescanning its folder.
+    added and removed are ROM filenames, renamed is a list of (old filename, new filename) pairs.
+    Falls back to a full process_sys rebuild if the existing lists can't be read.
+    """
+    print(f"Updating {system} index")
+    roms_path = os.path.join(drive, system)
+    index_paths = [os.path.join(drive, "Resources", index_file) for index_file in systems[system]]
+    for index_path in index_paths:
+        check_and_back_up_file(index_path)
+
+    try:
+        filenames = read_index_filenames(index_paths[0])
+    except (OSError, IOError, ValueError, struct.error) as error:
+        print(f"! Couldn't read the existing game list ({error}), rebuilding it instead")
+        return process_sys(drive, system, test_mode)
+
+    removed_names = list(removed) + [old_name for old_name, new_name in renamed]
+    added_names = list(added) + [new_name for old_name, new_name in renamed]
+    for filename in removed_names:
+        position = bisect.bisect_left(filenames, filename)
+        if position < len(filenames) and filenames[position] == filename:
+            del filenames[position]
+    for filename in added_names:
+        position = bisect.bisect_left(filenames, filename)
+        if position == len(filenames) or filenames[position] != filename:
+            filenames.insert(position, filename)
+
+    write_sys_indexes(filenames, index_paths, test_mode)
+
+    # keep the fingerprint in step so the next full rebuild can still be skipped
+    fingerprint_path = get_fingerprint_path(index_paths[0])
+    if not test_mode and os.path.exists(fingerprint_path):
+        try:
+            with open(fingerprint_path, 'r', encoding='utf-8') as file_handle:
+                rom_fingerprint = json.load(file_handle)["roms"]
+            for filename in removed_names:
+                rom_fingerprint.pop(filename, None)
+            for filename in added_names:
+                stat = os.stat(os.path.join(roms_path, filename))
+                rom_fingerprint[filename] = [stat.st_size, stat.st_mtime_ns]
+            write_fingerprint(fingerprint_path, dict(sorted(rom_fingerprint.items())), index_paths)
+        except (OSError, IOError, ValueError, KeyError, TypeError):
+            # the stored index hashes no longer match, so a stale fingerprint only means the next rebuild won't be skipped
+            print(f"! Failed updating fingerprint file {fingerprint_path}")
 
     print("Done\n")
-    return f"Finished updating {system} with {no_files} ROMs"
+    return f"Finished updating {system} with {len(filenames)} ROMs"
 
 
-def find_matching_file_diff_ext(target, files):
-    target_no_ext = strip_file_extension(target.name)
+def index_files_by_stem(files, ext_priority, description):
+    """
+    Maps each filename without its extension to one of the files, so pairs can be matched with a dict lookup.
+    When several files share a name the one whose extension comes first in ext_priority is used (then the first by
+    filename) and the others are reported and left alone.
+    """
+    files_by_stem = {}
     for file in files:
-        file_no_ext = strip_file_extension(file.name)
-        if file_no_ext == target_no_ext:
-            return file
-
-def convert_zip_image_pairs_to_zxx(roms_path, system):
-    img_files = os.scandir(roms_path)
-    img_files = list(filter(check_img, img_files))
-    zip_files = os.scandir(roms_path)
-    zip_files = list(filter(check_zip, zip_files))
+        files_by_stem.setdefault(file.stem, []).append(file)
+    ext_rank = {ext: rank for rank, ext in enumerate(ext_priority)}
+    stem_index = {}
+    for stem, matches in files_by_stem.items():
+        if len(matches) > 1:
+            matches.sort(key=lambda file: (ext_rank.get(file.ext, len(ext_rank)), file.name))
+            ignored = ", ".join(file.name for file in matches[1:])
+            print(f"! Found several {description} named {stem}, using {matches[0].name} and ignoring {ignored}")
+        stem_index[stem] = matches[0]
+    return stem_index
+
+def convert_zip_image_pairs_to_zxx(roms_path, system, progress_callback=None, image_source=None):
+    """
+    Combines each zip in roms_path with the image of the same name into a .z** file. The images come from roms_path
+    and are deleted once used, or from image_source (a folder or a zip or tar archive of images) and are left there.
+    """
+    files = drive_index.entries(roms_path)
+    img_files = list(filter(check_img, files)) if image_source is None else list_thumbnail_images(image_source)
+    zip_files = list(filter(check_zip, files))
     sys_zxx_ext = zxx_ext[system]
     if not img_files or not zip_files:
-        return
+        return 0
     print(f"Found image and zip files, looking for matches to combine to {sys_zxx_ext}")
 
-    imgs_processed = 0
-    for img_file in img_files:
-        zip_file = find_matching_file_diff_ext(img_file, zip_files)
-        if not zip_file:
-            continue
-        converted = convert_zip_image_to_zxx(roms_path, img_file, zip_file, sys_zxx_ext)
-        if not converted:
-            print("! Aborting image processing due to errors")
-            break
-        imgs_processed += 1
+    zip_index = index_files_by_stem(zip_files, ["zip", "bkp"], "zip files")
+    pairs = [(thumbnail_source(img_file), (img_file, zip_index[stem]))
+             for stem, img_file in index_files_by_stem(img_files, supported_img_ext, "images").items()
+             if stem in zip_index]
+
+    def write_pair(pair, thumbnail_data):
+        img_file, zip_file = pair
+        return convert_zip_image_to_zxx(roms_path, img_file, zip_file, sys_zxx_ext, thumbnail_data,
+                                        remove_image=image_source is None)
+
+    imgs_processed, failed = convert_thumbnail_batch(pairs, write_pair, progress_callback=progress_callback)
+    drive_index.invalidate(roms_path)
 
     if imgs_processed:
         print(f"Combined {imgs_processed} zip + image pairs into .{sys_zxx_ext} files")
+    if failed:
+        print(f"! {len(failed)} zip + image pairs couldn't be combined")
+    return imgs_processed
 
 
-def convert_zip_image_to_zxx(path, img_file, zip_file, zxx_ext):
+def convert_zip_image_to_zxx(path, img_file, zip_file, zxx_ext, thumbnail_data=None, remove_image=True):
 
-    img_file_path = os.path.join(path,img_file.name)
     zip_file_path = os.path.join(path,zip_file.name)
     zxx_file_name = f"{strip_file_extension(img_file.name)}.{zxx_ext}"
     zxx_file_path = os.path.join(path,zxx_file_name)
 
-    converted = rgb565_convert(img_file_path, zxx_file_path, defaultThumbnailSize)
+    if thumbnail_data is None:
+        converted = rgb565_convert(thumbnail_source(img_file), zxx_file_path, defaultThumbnailSize)
+    else:
+        converted = write_thumbnail_file(zxx_file_path, thumbnail_data)
     if not converted:
         return False
 
     try:
-        zxx_file_handle = open(zxx_file_path, "ab")
-        zip_file_handle = open(zip_file_path, "rb")
-        zxx_file_handle.write(zip_file_handle.read())
-        zxx_file_handle.close()
-        zip_file_handle.close()
+        with open(zip_file_path, "rb") as zip_file_handle, open(zxx_file_path, "r+b") as zxx_file_handle:
+            append_file_data(zip_file_handle, zxx_file_handle)
     except (OSError, IOError):
         print(f"! Failed appending zip file to {zxx_file_name}")
         return False
 
     try:
-        os.remove(img_file_path)
+        if remove_image:
+            os.remove(img_file.path)
         os.remove(zip_file_path)
     except (OSError, IOError):
         print(f"! Failed deleting source file(s) after creating {zxx_file_name}")
@@ -202,71 +851,572 @@ def convert_zip_image_to_zxx(path, img_file, zip_file, zxx_ext):
     return True
 
 
+copy_chunk_size = 1024 * 1024
+
+
+def copy_file_range_data(src_fd, dest_fd, src_offset, count):
+    return os.copy_file_range(src_fd, dest_fd, count, src_offset)
+
+
+def sendfile_data(src_fd, dest_fd, src_offset, count):
+    return os.sendfile(dest_fd, src_fd, src_offset, count)
+
+
+# ways of getting the kernel to copy between two files, tried in order, each writes at dest's current position
+kernel_copies = [copy_function for name, copy_function in (("copy_file_range", copy_file_range_data),
+                                                           ("sendfile", sendfile_data)) if hasattr(os, name)]
+
+
+def append_file_data(src_file, dest_file, offset=0):
+    """
+    Copies the data of src_file from offset to its end onto the end of dest_file (both open binary files, dest_file
+    not opened for append) without holding it all in memory, so building a .z** file takes the same memory whatever
+    the size of the ROM. The kernel copies it file to file where it can, otherwise it is copied in chunks.
+    Returns the number of bytes copied.
+    """
+    dest_file.flush()
+    dest_file.seek(0, os.SEEK_END)
+    size = os.fstat(src_file.fileno()).st_size - offset
+    copied = 0
+    for kernel_copy in kernel_copies:
+        try:
+            while copied < size:
+                count = kernel_copy(src_file.fileno(), dest_file.fileno(), offset + copied, size - copied)
+                if not count:
+                    break
+                copied += count
+            break
+        except OSError:
+            # not supported for these files (another filesystem, Windows shares...), try the next way
+            if copied:
+                raise
+    # bring the file object's position up to date after the kernel wrote through its descriptor
+    dest_file.seek(0, os.SEEK_END)
+    src_file.seek(offset + copied)
+    while True:
+        chunk = src_file.read(copy_chunk_size)
+        if not chunk:
+            break
+        dest_file.write(chunk)
+        copied += len(chunk)
+    return copied
+
+
+class OffsetWriter:
+    """
+    Presents the part of a file after its first offset bytes as a file of its own, so a zip written behind a thumbnail
+    gets offsets counted from the start of the zip, like a zip file appended to the thumbnail would have
+    """
+
+    def __init__(self, file, offset):
+        self._file = file
+        self._offset = offset
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def tell(self):
+        return self._file.tell() - self._offset
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position += self._offset
+        return self._file.seek(position, whence) - self._offset
+
+    def flush(self):
+        self._file.flush()
+
+
+def write_rom_to_zxx(rom_path, zxx_path, thumbnail_data):
+    """
+    Writes a .z** file for a ROM that isn't zipped, the thumbnail followed by the ROM deflated into a zip in one pass.
+    The file is put together in local temp space, then copied to the card once and renamed into place, so nothing else
+    is written to the card and an interrupted copy doesn't leave half a .z** file there.
+    """
+    temp_path = f"{zxx_path}.tmp"
+    try:
+        with tempfile.TemporaryFile() as local_file:
+            local_file.write(thumbnail_data)
+            zip_target = OffsetWriter(local_file, len(thumbnail_data))
+            with zipfile.ZipFile(zip_target, "w", zipfile.ZIP_DEFLATED) as zip_handle:
+                zip_handle.write(rom_path, arcname=os.path.basename(rom_path))
+            local_file.flush()
+            with open(temp_path, "wb") as zxx_file:
+                append_file_data(local_file, zxx_file)
+        os.replace(temp_path, zxx_path)
+    except (OSError, IOError, zipfile.LargeZipFile) as error:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        print(f"! Failed writing {zxx_path}. {error}")
+        return False
+    finally:
+        drive_index.invalidate_file(zxx_path)
+    return True
+
+
+def write_thumbnail_file(dest_filename, thumbnail_data):
+    try:
+        with open(dest_filename, "wb") as dest_file:
+            dest_file.write(thumbnail_data)
+    except (OSError, IOError):
+        print(f"! Failed opening destination file {dest_filename} for conversion")
+        return False
+    finally:
+        drive_index.invalidate_file(dest_filename)
+    return True
+
+
+# a thumbnail rewrite is journalled next to its .z** file as the magic, the sha256 of the thumbnail, then the thumbnail
+zxx_journal_ext = "thumbjournal"
+zxx_journal_magic = b"TPTJ"
+
+
+def sync_file(file_handle):
+    file_handle.flush()
+    os.fsync(file_handle.fileno())
+
+
+def sync_directory(dir_path):
+    # makes renames in a folder durable, Windows can't open a folder to fsync it and some filesystems refuse
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    try:
+        dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def write_zxx_thumbnail(zxx_path, thumbnail_data):
+    """
+    Replaces the thumbnail at the start of a .z** file in place, the ROM data after it isn't read or written.
+    The new thumbnail is saved to a journal next to the file before the file is touched, so if the card is pulled
+    while the header is half written recover_zxx_thumbnails can finish it.
+    """
+    if len(thumbnail_data) != thumbnail_data_size:
+        print(f"! Thumbnail for {zxx_path} is {len(thumbnail_data)} bytes, expected {thumbnail_data_size}")
+        return False
+    journal_path = f"{zxx_path}.{zxx_journal_ext}"
+    try:
+        if os.path.getsize(zxx_path) < thumbnail_data_size:
+            print(f"! {zxx_path} is too small to have a thumbnail")
+            return False
+        with open(journal_path, "wb") as journal_file:
+            journal_file.write(zxx_journal_magic + hashlib.sha256(thumbnail_data).digest() + thumbnail_data)
+            sync_file(journal_file)
+        with open(zxx_path, "r+b") as zxx_file:
+            zxx_file.write(thumbnail_data)
+            sync_file(zxx_file)
+        os.remove(journal_path)
+    except (OSError, IOError) as error:
+        print(f"! Failed writing the thumbnail of {zxx_path}. {error}")
+        return False
+    finally:
+        drive_index.invalidate_file(zxx_path)
+    return True
+
+
+def recover_zxx_thumbnails(roms_path):
+    """
+    Finishes any thumbnail rewrites in roms_path that were interrupted. A complete journal is written over its .z**
+    file again, an incomplete one means the .z** file was never touched, either way the journal is then removed.
+    Returns the number of thumbnails that were finished.
+    """
+    journals = [entry for entry in drive_index.entries(roms_path) if entry.ext == zxx_journal_ext]
+    recovered = 0
+    for journal in journals:
+        zxx_path = journal.path[:-len(zxx_journal_ext) - 1]
+        try:
+            with open(journal.path, "rb") as journal_file:
+                journal_data = journal_file.read()
+            digest_end = len(zxx_journal_magic) + hashlib.sha256().digest_size
+            thumbnail_data = journal_data[digest_end:]
+            if (journal_data.startswith(zxx_journal_magic) and len(thumbnail_data) == thumbnail_data_size
+                    and hashlib.sha256(thumbnail_data).digest() == journal_data[len(zxx_journal_magic):digest_end]
+                    and os.path.isfile(zxx_path)):
+                with open(zxx_path, "r+b") as zxx_file:
+                    zxx_file.write(thumbnail_data)
+                    sync_file(zxx_file)
+                print(f"Finished the interrupted thumbnail update of {zxx_path}")
+                recovered += 1
+            os.remove(journal.path)
+        except (OSError, IOError) as error:
+            print(f"! Failed recovering the thumbnail of {zxx_path}. {error}")
+    if journals:
+        drive_index.invalidate(roms_path)
+    return recovered
+
+
 def rgb565_convert(src_filename, dest_filename, dest_size=None):
     if not image_lib_avail:
         print("! Pillow module not found, can't do image conversion")
         return False
     try:
-        srcimage = Image.open(src_filename)
+        thumbnail_data = encode_thumbnail_file(src_filename, dest_size)
     except (OSError, IOError):
         print(f"! Failed opening image file {src_filename} for conversion")
         return False
+    thumbnail_cache.trim()
+    return write_thumbnail_file(dest_filename, thumbnail_data)
+
+
+class ThumbnailCache:
+    """
+    Keeps encoded RGB565 thumbnails on disk so converting the same cover again (another card, another rebuild) skips
+    decoding and resizing it. Entries are keyed by the sha256 of the source image file plus the size and the crop mode,
+    so a renamed or copied image still hits and an edited one misses. A hit touches the entry's modified time and
+    trim() removes the least recently used entries once the cache is over max_bytes.
+    The cache is only a shortcut, any error reading or writing it is ignored and the image is converted as normal.
+    """
+    version = 2
+    max_bytes = 256 * 1024 * 1024
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or os.path.join(os.path.expanduser("~"), ".tadpole", "thumbnail_cache")
+        self.enabled = True
+        # bytes written by this process since the folder was last measured, None until it has been measured
+        self._size_estimate = None
+        self._lock = threading.Lock()
+
+    def key(self, src_data, dest_size, mode):
+        size = f"{dest_size[0]}x{dest_size[1]}" if dest_size else "original"
+        return f"{hashlib.sha256(src_data).hexdigest()}_{size}_{mode}_v{self.version}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_path, key[:2], key + ".rgb565")
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "rb") as entry_file:
+                thumbnail_data = entry_file.read()
+            os.utime(entry_path)
+        except OSError:
+            return None
+        return thumbnail_data
+
+    def put(self, key, thumbnail_data):
+        if not self.enabled:
+            return
+        entry_path = self._entry_path(key)
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            with open(tmp_path, "wb") as entry_file:
+                entry_file.write(thumbnail_data)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            if self._size_estimate is not None:
+                self._size_estimate += len(thumbnail_data)
+
+    def trim(self, force=False):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes. The folder is only measured when
+        this process has written enough to possibly go over, or with force=True after other processes have written.
+        """
+        with self._lock:
+            if not self.enabled or (not force and self._size_estimate is not None
+                                    and self._size_estimate <= self.max_bytes):
+                return
+            entries = []
+            try:
+                with os.scandir(self.cache_path) as buckets:
+                    for bucket in buckets:
+                        if not bucket.is_dir():
+                            continue
+                        with os.scandir(bucket.path) as bucket_entries:
+                            for entry in bucket_entries:
+                                if entry.is_file():
+                                    stat = entry.stat()
+                                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            except OSError:
+                return
+            total = sum(size for mtime_ns, size, path in entries)
+            if total > self.max_bytes:
+                entries.sort()
+                for mtime_ns, size, path in entries:
+                    with contextlib.suppress(OSError):
+                        os.remove(path)
+                        total -= size
+                    if total <= self.max_bytes:
+                        break
+            self._size_estimate = total
+
+
+thumbnail_cache = ThumbnailCache()
+
+
+def thumbnail_crop_box(image_size, dest_size):
+    # the centred part of the image with the aspect ratio of dest_size
+    width, height = image_size
+    ratio = dest_size[1] / dest_size[0]
+    if width * ratio > height:
+        crop_width = height / ratio
+        left = (width - crop_width) / 2
+        return (left, 0, left + crop_width, height)
+    crop_height = width * ratio
+    top = (height - crop_height) / 2
+    return (0, top, width, top + crop_height)
+
+
+def encode_thumbnail_file(src_filename, dest_size=None, crop=True):
+    """
+    Opens an image (a path or an ArchiveImage), crops it to the aspect ratio of dest_size (or stretches it if crop is
+    False), resizes it and returns it encoded as RGB565. Results are looked up in and added to thumbnail_cache.
+    Big covers are never decoded or copied at full size when they don't need to be: JPEGs are decoded straight at the
+    smallest 1/2, 1/4 or 1/8 scale that still covers dest_size, and the crop and any whole-number shrink are done
+    as part of the resize.
+    Raises OSError if the image can't be read. This only uses Pillow so it can be run in worker processes.
+    """
+    src_data = read_thumbnail_source(src_filename)
+    cache_key = thumbnail_cache.key(src_data, dest_size, "crop" if crop else "stretch")
+    thumbnail_data = thumbnail_cache.get(cache_key)
+    if thumbnail_data is not None:
+        return thumbnail_data
+
+    with Image.open(io.BytesIO(src_data)) as srcimage:
+        if dest_size and srcimage.size != dest_size:
+            # TODO Let user pick if they want to stretch or not
+            def source_box(image_size):
+                return thumbnail_crop_box(image_size, dest_size) if crop else (0, 0) + image_size
+
+            crop_box = source_box(srcimage.size)
+            if srcimage.format == "JPEG":
+                scale = min((crop_box[2] - crop_box[0]) / dest_size[0], (crop_box[3] - crop_box[1]) / dest_size[1])
+                if scale >= 2:
+                    srcimage.draft("RGB", (math.ceil(srcimage.size[0] / scale), math.ceil(srcimage.size[1] / scale)))
+                    crop_box = source_box(srcimage.size)
+            # images with alpha or a palette are flattened first so alpha is dropped the same way as before, instead
+            # of being used to weight the resize
+            image = srcimage if srcimage.mode in ("RGB", "L") else srcimage.convert("RGB")
+            image = image.resize(dest_size, Image.BICUBIC, box=crop_box, reducing_gap=3.0)
+        else:
+            image = srcimage.convert("RGB")
+
+    thumbnail_data = image_to_rgb565(image)
+    thumbnail_cache.put(cache_key, thumbnail_data)
+    return thumbnail_data
+
+
+process_pool = None
+process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """
+    The pool of worker processes shared by every batch, started the first time one needs it, or None if processes
+    can't be used here. Workers are started by a forkserver where there is one: forking this process while another
+    thread holds a lock, like thumbnail_cache's during a trim, would leave the worker waiting on it forever.
+    """
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            context = None
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+            try:
+                process_pool = ProcessPoolExecutor(mp_context=context)
+            except (OSError, NotImplementedError, ImportError):
+                # no process support here (or no semaphores)
+                return None
+        return process_pool
+
+
+def drop_process_pool(pool):
+    # a broken pool takes no more work, the next batch starts a new one
+    global process_pool
+    with process_pool_lock:
+        if process_pool is pool:
+            process_pool = None
+    pool.shutdown(wait=False)
+
+
+def run_in_process_pool(func, items, on_result, max_workers=None):
+    """
+    Calls func(*args) for each tuple of args in items in the shared pool of worker processes, and on_result(index,
+    result, error) from the calling thread as each one finishes, error being what func raised or None. A batch has
+    at most max_workers calls in the pool at a time, with max_workers=1 or a single item everything runs here.
+    If the pool stops, the calls that didn't finish are run here instead.
+    Returns True if the pool was used.
+    """
+    pool = get_process_pool() if len(items) > 1 and max_workers != 1 else None
+    finished = set()
+    if pool:
+        pending = {}
+        next_index = 0
+        try:
+            while next_index < len(items) or pending:
+                while next_index < len(items) and len(pending) < (max_workers or len(items)):
+                    try:
+                        pending[pool.submit(func, *items[next_index])] = next_index
+                    except RuntimeError as e:
+                        # another batch found the pool broken and shut it down
+                        raise BrokenProcessPool(str(e))
+                    next_index += 1
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    try:
+                        result, error = future.result(), None
+                    except BrokenProcessPool:
+                        # not this item's fault, it is run again below with the rest
+                        raise
+                    except Exception as e:
+                        result, error = None, e
+                    finished.add(index)
+                    on_result(index, result, error)
+        except BrokenProcessPool:
+            print("! Worker processes stopped, finishing the rest here")
+            drop_process_pool(pool)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    for index, args in enumerate(items):
+        if index in finished:
+            continue
+        try:
+            result, error = func(*args), None
+        except Exception as e:
+            result, error = None, e
+        on_result(index, result, error)
+    return pool is not None
+
+
+def convert_thumbnail_batch(items, write_item, dest_size=defaultThumbnailSize, progress_callback=None,
+                            max_workers=None):
+    """
+    Converts a batch of thumbnails. items is a list of (image path or ArchiveImage, item) pairs, the images are decoded,
+    cropped, resized and encoded in a pool of worker processes, and write_item(item, thumbnail_data) is called from this
+    process as each one is ready, so all the card writes happen here. write_item returns False if the item failed.
+    A failed item is reported and skipped, it doesn't stop the rest of the batch.
+    progress_callback is called from this process with the number of items done and the total.
+    Returns the number of items converted and a list of (image path, reason) for the ones that failed.
+    """
+    converted = 0
+    failed = []
+    if not items:
+        return converted, failed
+    if not image_lib_avail:
+        print("! Pillow module not found, can't do image conversion")
+        return converted, [(src_filename, "Pillow not available") for src_filename, item in items]
+
+    done = 0
+
+    def finish_item(index, thumbnail_data, error):
+        nonlocal converted, done
+        src_filename, item = items[index]
+        done += 1
+        if error is not None:
+            print(f"! Failed converting image file {src_filename}. {error}")
+            failed.append((str(src_filename), str(error)))
+        elif not write_item(item, thumbnail_data):
+            failed.append((str(src_filename), "Failed writing thumbnail"))
+        else:
+            converted += 1
+        if progress_callback:
+            progress_callback(done, len(items))
+
+    used_pool = run_in_process_pool(encode_thumbnail_file, [(src_filename, dest_size) for src_filename, item in items],
+                                    finish_item, max_workers)
+    close_archives()
+    # the workers added to the cache without seeing each other's entries, so measure it again
+    thumbnail_cache.trim(force=used_pool)
+    return converted, failed
+
+
+# lookup tables for image_to_rgb565, each one picks out a channel's bits of the low or high RGB565 byte
+rgb565_low_green_lut = [(value << 3) & 0xE0 for value in range(256)]
+rgb565_low_blue_lut = [value >> 3 for value in range(256)]
+rgb565_high_red_lut = [value & 0xF8 for value in range(256)]
+rgb565_high_green_lut = [value >> 5 for value in range(256)]
+
+
+def image_to_rgb565(image):
+    """
+    Encodes a Pillow image as little endian RGB565, row by row from the top left, the format of the SF2000 thumbnails,
+    boot logo and backgrounds. Pillow can't pack to this mode itself, so each output byte is built as its own 8 bit
+    band from lookup tables (the bits taken from each channel don't overlap, so adding them can't overflow) and the
+    two bands are interleaved by tobytes.
+    """
+    red, green, blue = image.convert("RGB").split()
+    low_byte = ImageChops.add(green.point(rgb565_low_green_lut), blue.point(rgb565_low_blue_lut))
+    high_byte = ImageChops.add(red.point(rgb565_high_red_lut), green.point(rgb565_high_green_lut))
+    return Image.merge("LA", (low_byte, high_byte)).tobytes()
+
+
+placeholder_thumbnails = {
+    # RGB565 black is all zero bits
+    "black": bytes(thumbnail_data_size),
+    # the fill tadpole has always given blank arcade .zfb files
+    "fill": b"\x01" * thumbnail_data_size
+}
+
+
+def get_placeholder_thumbnail(placeholder="black"):
+    """
+    Returns an encoded thumbnail to use for .zfb files that don't have their own cover. placeholder is "black",
+    "fill" or the path of an image, which is converted once and reused until the file changes.
+    Returns None if the image can't be converted.
+    """
+    if placeholder in placeholder_thumbnails:
+        return placeholder_thumbnails[placeholder]
+    try:
+        key = (os.path.abspath(placeholder), os.stat(placeholder).st_mtime_ns)
+    except OSError:
+        print(f"! Failed opening image file {placeholder} for conversion")
+        return None
+    if key not in placeholder_thumbnails:
+        if not image_lib_avail:
+            print("! Pillow module not found, can't do image conversion")
+            return None
+        try:
+            placeholder_thumbnails[key] = encode_thumbnail_file(placeholder, defaultThumbnailSize, crop=False)
+        except (OSError, IOError):
+            print(f"! Failed opening image file {placeholder} for conversion")
+            return None
+        thumbnail_cache.trim()
+    return placeholder_thumbnails[key]
+
+
+def build_zfb_content(thumbnail_data, rom_filename):
+    # a .zfb is the thumbnail, then the name of the ROM to load from the bin folder
+    return b"".join([thumbnail_data, zfb_separator, rom_filename.encode(), zfb_terminator])
+
+
+def write_zfb_file(zfb_path, rom_filename, thumbnail_data):
     try:
-        dest_file = open(dest_filename, "wb")
+        with open(zfb_path, "wb") as zfb_file:
+            zfb_file.write(build_zfb_content(thumbnail_data, rom_filename))
     except (OSError, IOError):
-        print(f"! Failed opening destination file {dest_filename} for conversion")
+        print(f"! Failed writing {zfb_path}")
         return False
-    # convert the image to RGB if it was not already
-    image = Image.new('RGB', srcimage.size, (0, 0, 0))
-    image.paste(srcimage, None)
-
-    if dest_size and image.size != dest_size:
-        ratio = dest_size[1] / dest_size[0]
-        if ((image.size[0] * ratio) > image.size[1]):
-            width = image.size[1]/ratio
-            left = int((image.size[0] - width)/2)
-            image = image.crop((left, 0, left + width, image.size[1]))
-        else:
-            height = image.size[0]*ratio
-            top = int((image.size[1] - height)/2)
-            image = image.crop((0, top, image.size[0], top + height))
-
-        # new_size=(144, 208)
-        # fill_color=(0, 0, 0, 0)
-        # size_x = max(dest_size[0], x)
-        # size_y = max(dest_size[1], y)
-        # new_im = Image.new('RGB', (new_size[0], new_size[1]), fill_color)
-        # new_im.paste(image, (int((size_x - x) / 2), int((size_y - y) / 2)))
-        # image = new_im
-        # TODO Let user pick if they want to stretch or not
-        #image = image.scaled(144, 208, Qt.KeepAspectRatio, Qt.SmoothTransformation) #Rescale new boot logo to correct size
-        image = image.resize(dest_size)
-        #maxsize = (144, 208)
-        #image = image.thumbnail(maxsize) 
-
-    image_height = image.size[1]
-    image_width = image.size[0]
-    pixels = image.load()
-
-    if not pixels:
-        print(f"! Failed to load image from {src_filename}")
-        return False
-
-    for h in range(image_height):
-        for w in range(image_width):
-            pixel = pixels[w, h]
-            if not type(pixel) is tuple:
-                print(f"! Unexpected pixel type at {w}x{h} from {src_filename}")
-                return False
-            r = pixel[0] >> 3
-            g = pixel[1] >> 2
-            b = pixel[2] >> 3
-            rgb = (r << 11) | (g << 5) | b
-            dest_file.write(struct.pack('H', rgb))
-    dest_file.close()
+    finally:
+        drive_index.invalidate_file(zfb_path)
     return True
 
 
+def rgb565_to_image(data, size=defaultThumbnailSize):
+    """
+    Decodes little endian RGB565 from bytes, a memoryview or an mmap slice into a Pillow RGB image of the given size.
+    Anything past width x height pixels is ignored and missing pixels are left black.
+    """
+    data_size = size[0] * size[1] * 2
+    data = bytes(data[:data_size]).ljust(data_size, b"\0")
+    return Image.frombytes("RGB", size, data, "raw", "BGR;16")
+
+
 def check_and_back_up_file(file_path):
     if not os.path.exists(file_path):
         print(f"! Couldn't find game list file {file_path}")
@@ -283,37 +1433,55 @@ def check_and_back_up_file(file_path):
             raise StopExecution
 
 
-def write_index_file(name_map, sort_func, index_path, test_mode):
+def build_index_content(name_map, sort_func):
     # entries must maintain a consistent order between all indexes, but what that order actually is doesn't matter
     # so use alphabetised filenames for this
     sorted_filenames = sorted(name_map.keys())
-    # build up the list of names in that order as a byte string, and also build a dict of pointers to each name
-    names_bytes = b""
+    encoded_names = [name_map[filename].encode('utf-8') for filename in sorted_filenames]
+    no_names = len(encoded_names)
+    pointer_table_size = 4 * (no_names + 1)
+    names_size = sum(map(len, encoded_names)) + no_names
+
+    # the whole file is allocated up front: the count, a pointer per name, then the null terminated names
+    content = bytearray(pointer_table_size + names_size)
     pointers_by_name = {}
-    for filename in sorted_filenames:
-        display_name = name_map[filename]
-        current_pointer = len(names_bytes)
-        pointers_by_name[display_name] = current_pointer
-        names_bytes += display_name.encode('utf-8') + chr(0).encode('utf-8')
-
-    # build the metadata - first value is the total count of games in this list
-    metadata_bytes = int_to_4_bytes_reverse(len(name_map))
-    # the rest are pointers to the display names in the desired display order
-    # so sort display names according to the display order, and build a list of pointers in that order
+    current_pointer = 0
+    for filename, encoded_name in zip(sorted_filenames, encoded_names):
+        pointers_by_name[name_map[filename]] = current_pointer
+        name_start = pointer_table_size + current_pointer
+        content[name_start:name_start + len(encoded_name)] = encoded_name
+        # the terminating null byte is already there from the allocation
+        current_pointer += len(encoded_name) + 1
+
+    # the metadata is the total count of games in this list followed by pointers to the display names in the
+    # desired display order, so sort display names according to the display order and look up each pointer
     sorted_display_names = sort_func(name_map.values())
-    sorted_pointers = map(lambda name: pointers_by_name[name], sorted_display_names)
-    for current_pointer in sorted_pointers:
-        metadata_bytes += int_to_4_bytes_reverse(current_pointer)
+    sorted_pointers = [pointers_by_name[name] for name in sorted_display_names]
+    struct.pack_into(f"<{no_names + 1}I", content, 0, len(name_map), *sorted_pointers)
+    return bytes(content)
+
+
+def write_index_file(name_map, sort_func, index_path, test_mode):
+    write_index_content(build_index_content(name_map, sort_func), index_path, test_mode)
 
-    new_index_content = metadata_bytes + names_bytes
 
+def write_index_content(new_index_content, index_path, test_mode):
     if test_mode:
         print(f"Checking {index_path}")
-        file_handle = open(index_path, 'rb')
-        existing_index_content = file_handle.read(os.path.getsize(index_path))
-        file_handle.close()
-        if existing_index_content != new_index_content:
-            print("! Doesn't match")
+        try:
+            index_diff = check_index_content(new_index_content, index_path)
+        except (OSError, IOError, ValueError) as error:
+            print(f"! Couldn't read existing index. {error}")
+            return
+        if not index_diff["matches"]:
+            print(f"! Doesn't match: {len(index_diff['missing'])} missing, {len(index_diff['extra'])} extra, "
+                  f"{len(index_diff['reordered'])} reordered")
+            for name in index_diff["missing"]:
+                print(f"  missing: {name}")
+            for name in index_diff["extra"]:
+                print(f"  extra: {name}")
+            for name in index_diff["reordered"]:
+                print(f"  reordered: {name}")
         return
 
     print(f"Overwriting {index_path}")
@@ -327,8 +1495,93 @@ def write_index_file(name_map, sort_func, index_path, test_mode):
         raise StopExecution
 
 
+def write_index_contents(index_contents, index_paths, test_mode):
+    """
+    Replaces a system's index files together. Every list is written and synced to a temp file next to its index, then
+    they are all renamed into place and the folder is synced, so a failed write never leaves the lists out of step.
+    """
+    if test_mode:
+        for new_index_content, index_path in zip(index_contents, index_paths):
+            write_index_content(new_index_content, index_path, test_mode)
+        return
+
+    temp_paths = [f"{index_path}.tmp" for index_path in index_paths]
+    try:
+        for new_index_content, temp_path in zip(index_contents, temp_paths):
+            with open(temp_path, 'wb') as file_handle:
+                file_handle.write(new_index_content)
+                sync_file(file_handle)
+    except (IOError, OSError):
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        print("! Failed writing game list files.")
+        print("  Check the SD card and Resources directory are writable.")
+        raise StopExecution
+
+    try:
+        for temp_path, index_path in zip(temp_paths, index_paths):
+            print(f"Overwriting {index_path}")
+            os.replace(temp_path, index_path)
+    except (IOError, OSError):
+        print("! Failed overwriting file.")
+        print("  Check the SD card and file are writable, and the file is not open in another program.")
+        raise StopExecution
+    for index_dir in sorted({os.path.dirname(index_path) for index_path in index_paths}):
+        sync_directory(index_dir)
+
+
 def check_sys_valid(system):
     return system and (system in systems.keys() or system == "ALL")
 
 
-
+def run_cli(args):
+    if args.audit:
+        results = {}
+        for system in (systems if args.system == "ALL" else [args.system]):
+            try:
+                results[system] = audit_sys(args.drive, system)
+            except (StopExecution, OSError, ValueError):
+                results[system] = None
+        return results, all(audits and all(audit["matches"] for audit in audits) for audits in results.values())
+    if args.system == "ALL":
+        results = process_all_sys(args.drive, args.check)
+    else:
+        results = {args.system: process_sys_timed(args.drive, args.system, args.check)}
+    return results, not any(result["error"] for result in results.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuilds the SF2000 game lists on an SD card")
+    parser.add_argument("drive", help="root of the SD card")
+    parser.add_argument("system", nargs="?", default="ALL", help=f"one of {', '.join(systems)} or ALL")
+    parser.add_argument("-sc", "--check", action="store_true", help="compare the lists on the card without writing")
+    parser.add_argument("--audit", action="store_true",
+                        help="compare the lists on the card without converting thumbnails or writing")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+    if not check_sys_valid(args.system):
+        parser.error(f"Invalid system {args.system}")
+
+    start_time = time.perf_counter()
+    if args.json:
+        # the progress messages go to stderr so stdout only carries the JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            results, ok = run_cli(args)
+        print(json.dumps({"ok": ok, "seconds": time.perf_counter() - start_time, "results": results}, indent=2))
+    else:
+        results, ok = run_cli(args)
+        for system, result in results.items():
+            if not args.audit:
+                print(result["message"])
+            elif result is None:
+                print(f"{system}: couldn't be audited")
+            else:
+                stale = [os.path.basename(audit["path"]) for audit in result if not audit["matches"]]
+                print(f"{system}: {'out of date (' + ', '.join(stale) + ')' if stale else 'up to date'}")
+        print(f"Finished in {time.perf_counter() - start_time:.2f}s")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
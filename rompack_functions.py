@@ -0,0 +1,164 @@
+# OS imports
+import frogtool
+import logging
+import os
+import tempfile
+import zipfile
+from zxxContainer import ZXXContainer
+
+# stored zips load fastest on the device as nothing has to be inflated, deflate at level 9 saves the most space
+packPolicies = {
+    "stored": (zipfile.ZIP_STORED, None),
+    "deflate": (zipfile.ZIP_DEFLATED, 9)
+}
+
+
+def getPackKind(name):
+    categories = frogtool.classify_file(name)
+    if "zxx" in categories:
+        # a .zfb only names a zip in ARCADE/bin, it has no ROM data of its own
+        return None if frogtool.get_file_ext(name) == "zfb" else "zxx"
+    if "zip" in categories:
+        return "zip"
+    if "rom" in categories:
+        return "raw"
+    return None
+
+
+def getInflateSize(zip_handle):
+    # the bytes the device has to inflate to load the ROM, stored members are read as they are
+    return sum(info.file_size for info in zip_handle.infolist() if info.compress_type != zipfile.ZIP_STORED)
+
+
+def repackROM(rom_path, kind, policy):
+    """
+    Zips a bare ROM, or rewrites the zip of a .zip or .z** file, into a new zip in local temp space compressed the way
+    the policy asks. Under stored, zips that are already stored are left alone, and so are bare ROMs, which already
+    load without inflating and would only grow by the zip headers. Under deflate, zips are always deflated again at
+    level 9, as they may have been deflated at a lower level, and left alone if that doesn't make them smaller.
+    Nothing on the card is changed, this runs in a worker process and applyRepack puts the result on the card.
+    """
+    compression, level = packPolicies[policy]
+    before = os.path.getsize(rom_path)
+    result = {"path": rom_path, "kind": kind, "status": "unchanged", "temp_path": None,
+              "before": before, "after": before, "inflate_before": 0, "inflate_after": 0}
+    if kind == "raw" and compression == zipfile.ZIP_STORED:
+        return result
+    header_size = frogtool.thumbnail_data_size if kind == "zxx" else 0
+    old_infos = []
+    if kind != "raw":
+        # zipfile finds the zip behind a .z** thumbnail by itself, and checks every member's CRC as it is read
+        with zipfile.ZipFile(rom_path) as old_zip:
+            old_infos = old_zip.infolist()
+            result["inflate_before"] = result["inflate_after"] = getInflateSize(old_zip)
+            if compression == zipfile.ZIP_STORED and all(info.compress_type == compression for info in old_infos):
+                return result
+
+    temp_handle, temp_path = tempfile.mkstemp(suffix=".zip")
+    os.close(temp_handle)
+    try:
+        with zipfile.ZipFile(temp_path, "w", compression, compresslevel=level) as new_zip:
+            if kind == "raw":
+                new_zip.write(rom_path, arcname=os.path.basename(rom_path))
+            else:
+                with zipfile.ZipFile(rom_path) as old_zip:
+                    for old_info in old_infos:
+                        new_info = zipfile.ZipInfo(old_info.filename, old_info.date_time)
+                        new_info.external_attr = old_info.external_attr
+                        new_zip.writestr(new_info, old_zip.read(old_info), compression, level)
+            new_infos = new_zip.infolist()
+            inflate_after = getInflateSize(new_zip)
+        if kind != "raw" and \
+                [(info.filename, info.CRC) for info in new_infos] != [(info.filename, info.CRC) for info in old_infos]:
+            raise zipfile.BadZipFile(f"Repacked zip of {rom_path} doesn't match the original")
+        after = header_size + os.path.getsize(temp_path)
+        if policy == "deflate" and kind != "raw" and after >= before:
+            os.remove(temp_path)
+            return result
+    except Exception:
+        os.remove(temp_path)
+        raise
+    result.update(status="repacked", temp_path=temp_path, after=after, inflate_after=inflate_after)
+    return result
+
+
+def applyRepack(result):
+    """
+    Puts a zip made by repackROM on the card, copied next to its destination and renamed over it. A .z** file keeps
+    its thumbnail, a bare ROM becomes a .zip of the same name and the ROM is removed.
+    """
+    rom_path = result["path"]
+    if result["kind"] == "raw":
+        dest_path = os.path.splitext(rom_path)[0] + ".zip"
+    else:
+        dest_path = rom_path
+    card_temp_path = f"{dest_path}.tmp"
+    try:
+        header = b""
+        if result["kind"] == "zxx":
+            with ZXXContainer(rom_path) as rom:
+                header = bytes(rom.thumbnail_view)
+        with open(result["temp_path"], "rb") as new_zip, open(card_temp_path, "wb") as card_file:
+            card_file.write(header)
+            frogtool.append_file_data(new_zip, card_file)
+        os.replace(card_temp_path, dest_path)
+        if dest_path != rom_path:
+            os.remove(rom_path)
+    except (OSError, IOError) as error:
+        if os.path.exists(card_temp_path):
+            os.remove(card_temp_path)
+        print(f"! Failed writing repacked {rom_path}. {error}")
+        return False
+    finally:
+        os.remove(result["temp_path"])
+        frogtool.drive_index.invalidate_file(rom_path)
+    return True
+
+
+def packROMs(roms_path, policy="stored", progress_callback=None, max_workers=None):
+    """
+    Rewrites the zips of a folder's .zip and .z** files with the given policy, "stored" or "deflate", and under
+    deflate zips its bare ROMs too. The compression runs in frogtool's pool of worker processes, the card is only written from this process.
+    progress_callback is called with the number of ROMs done and the total.
+    Returns a summary with a result per ROM, the bytes saved on the card and the change in bytes the device has to
+    inflate to load the ROMs.
+    """
+    logging.info(f"rompack_functions~packROMs {roms_path} {policy}")
+    entries = frogtool.drive_index.entries(roms_path)
+    names = {entry.name.lower() for entry in entries}
+    items = []
+    summary = {"policy": policy, "roms": [], "repacked": 0, "unchanged": 0, "failed": 0,
+               "bytes_saved": 0, "inflate_bytes_delta": 0}
+    for entry in entries:
+        kind = getPackKind(entry.name)
+        # a bare ROM is only zipped if that doesn't overwrite a zip of the same name
+        if kind == "raw" and policy != "stored" and f"{entry.stem}.zip".lower() in names:
+            print(f"! Not zipping {entry.name}, {entry.stem}.zip already exists")
+            continue
+        if kind:
+            items.append((entry.path, kind, policy))
+
+    done = 0
+
+    def finishItem(index, result, error):
+        nonlocal done
+        rom_path, kind, policy = items[index]
+        done += 1
+        if error is None and result["temp_path"] and not applyRepack(result):
+            error = "Failed writing to the card"
+        if error is not None:
+            print(f"! Failed repacking {rom_path}. {error}")
+            summary["failed"] += 1
+            summary["roms"].append({"path": rom_path, "kind": kind, "status": "failed", "error": str(error)})
+        else:
+            result.pop("temp_path")
+            summary[result["status"]] += 1
+            summary["bytes_saved"] += result["before"] - result["after"]
+            summary["inflate_bytes_delta"] += result["inflate_after"] - result["inflate_before"]
+            summary["roms"].append(result)
+        if progress_callback:
+            progress_callback(done, len(items))
+
+    frogtool.run_in_process_pool(repackROM, items, finishItem, max_workers)
+    frogtool.drive_index.invalidate(roms_path)
+    return summary
@@ -1,4 +1,5 @@
 import os
+import frogtool
 
 class sf2000ROM():
     ROMlocation = ""
@@ -24,6 +25,7 @@ class sf2000ROM():
             ext = os.path.splitext(self.ROMlocation)[1]
             newPath = os.path.join(os.path.dirname(self.ROMlocation),newTitle+ext)
             os.rename(self.ROMlocation, newPath)
+            frogtool.drive_index.invalidate_file(newPath)
             self.ROMlocation = newPath         
             self.title = newTitle
             return True
@@ -1,11 +1,15 @@
 import os
 import logging
+import multiprocessing
 
 from sf2000ROM import sf2000ROM
+from zxxContainer import ZXXContainer
 static_TadpoleDir = os.path.join(os.path.expanduser('~'), '.tadpole')
 static_LoggingPath = os.path.join(static_TadpoleDir, 'tadpole.log')
 static_TadpoleConfigFile = os.path.join(static_TadpoleDir, 'tadpole.ini')
 if __name__ == "__main__":
+        # Thumbnail conversion runs in worker processes, which the frozen executable has to hand off to first
+        multiprocessing.freeze_support()
         # Per logger documentation, create logging as soon as possible before other hreads    
         if not os.path.exists(static_TadpoleDir):
             os.mkdir(static_TadpoleDir)
@@ -77,14 +81,20 @@ def RunFrogTool(drive, console):
             progress = 20
             rebuildingmsgBox.showProgress(progress, True)
             rebuildingmsgBox.show()
-            for console in frogtool.systems.keys():
-                result = frogtool.process_sys(drive, console, False)
+            def showSystemRebuilt(result, completed, total):
                 #Update Progress
-                progress += 10
-                rebuildingmsgBox.showProgress(progress, True)
-            #TODO: eventually we could return a total roms across all systems, but not sure users will care
+                rebuildingmsgBox.setText(f"Rebuilding roms...\n{result['message']}")
+                rebuildingmsgBox.showProgress(progress + int((100 - progress) * completed / total), True)
+            results = frogtool.process_all_sys(drive, False, showSystemRebuilt)
             rebuildingmsgBox.close()
-            QMessageBox.about(window, "Result", "Rebuilt all ROMS for all systems")
+            summary = []
+            for console in frogtool.systems.keys():
+                result = results[console]
+                seconds = result['scan_seconds'] + result['write_seconds']
+                summary.append(f"{result['message']} ({seconds:.1f}s)")
+                logging.info(f"RunFrogTool: {result}")
+            totalROMs = sum(result['roms'] for result in results.values())
+            QMessageBox.about(window, "Result", f"Rebuilt all ROMS for all systems ({totalROMs} ROMs)\n\n" + "\n".join(summary))
         else:
             result = frogtool.process_sys(drive, console, False)
             print("Result " + result)      
@@ -93,6 +103,20 @@ def RunFrogTool(drive, console):
     except frogtool.StopExecution:
         pass
 
+def UpdateFrogToolIndex(drive, console, added=(), removed=(), renamed=(), reloadTable=True):
+    if drive == 'N/A':
+        logging.warning("You are trying to update the game list with no drive.")
+        return
+    print(f"Updating frogtool index with drive ({drive}) and console ({console})")
+    logging.info(f"Updating frogtool index with drive ({drive}) and console ({console}): added {list(added)}, removed {list(removed)}, renamed {list(renamed)}")
+    try:
+        result = frogtool.update_sys_index(drive, console, added, removed, renamed)
+        print("Result " + result)
+        if reloadTable:
+            window.loadROMsToTable()
+    except frogtool.StopExecution:
+        pass
+
 # SubClass QMainWindow to create a Tadpole general interface
 class MainWindow (QMainWindow):
     _static_columns_GameName    = "Name"
@@ -405,7 +429,14 @@ class MainWindow (QMainWindow):
         print(f"Changed Cell for ({changedRow},{changedColumn})")
         if self.columns[changedColumn] == self._static_columns_GameName:
             # Update the game name
-            self.ROMList[changedRow].setTitle(self.sender().itemAt(changedColumn,changedRow).text())
+            objGame = self.ROMList[changedRow]
+            oldFilename = os.path.basename(objGame.ROMlocation)
+            if objGame.setTitle(self.tbl_gamelist.item(changedRow, changedColumn).text()):
+                # The table already shows the new name so only the game lists need the change
+                UpdateFrogToolIndex(self.combobox_drive.currentText(),
+                                    self.combobox_console.currentText(),
+                                    renamed=[(oldFilename, os.path.basename(objGame.ROMlocation))],
+                                    reloadTable=False)
 
     def catchTableCellClicked(self, clickedRow, clickedColumn):
         print(f"clicked Cell for ({clickedRow},{clickedColumn})")
@@ -543,28 +574,39 @@ class MainWindow (QMainWindow):
         #Check what the user has configured; local or download
         ovewrite = tpConf.getThumbnailOverwrite()
         if not tpConf.getThumbnailDownload():
-            # User has chosen to use local thumbnails
-            directory = QFileDialog.getExistingDirectory()
-            if directory == '':
+            # User has chosen to use local thumbnails, either a folder of images or an archive of them (like the
+            # libretro thumbnail packs) which is read in place rather than extracted
+            sourceBox = QMessageBox(self)
+            sourceBox.setWindowTitle("Add Thumbnails")
+            sourceBox.setText("Are your thumbnails in a folder or in a zip/tar archive?")
+            folderButton = sourceBox.addButton("Folder", QMessageBox.AcceptRole)
+            archiveButton = sourceBox.addButton("Archive", QMessageBox.AcceptRole)
+            sourceBox.addButton(QMessageBox.Cancel)
+            sourceBox.exec()
+            if sourceBox.clickedButton() == folderButton:
+                source = QFileDialog.getExistingDirectory()
+            elif sourceBox.clickedButton() == archiveButton:
+                source, _ = QFileDialog.getOpenFileName(self, "Select Thumbnail Archive", '',
+                                                        "Image archives (*.zip *.tar)")
+            else:
+                return
+            if source == '':
                     return
-            files = os.listdir(directory)
+            #Only copy images over from that folder or archive, matched to the ROMs by name
+            images = frogtool.list_thumbnail_images(source)
+            imageIndex = frogtool.index_files_by_stem(images, frogtool.supported_img_ext, "images")
+            romThumbnails = []
+            for rom in romList:
+                romName = os.path.splitext(rom)[0]
+                if romName in imageIndex:
+                    romThumbnails.append((os.path.join(rom_path, rom), frogtool.thumbnail_source(imageIndex[romName])))
             #Setup progress as these can take a while
-            msgBox.progress.setMaximum(len(romList))
+            msgBox.progress.setMaximum(len(romThumbnails))
             msgBox.setText("Copying thumbnails for zips")
             msgBox.showProgress(0, True)
             msgBox.show()
-            for i, newThumbnail in enumerate(files):
-                newThumbnailName = os.path.splitext(newThumbnail)[0]
-                newThumbnailPath = os.path.join(directory, newThumbnail)
-                #Only copy images over from that folder
-                if newThumbnail.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                    for rom in romList:
-                        romName = os.path.splitext(rom)[0]
-                        if newThumbnailName == romName:
-                            rom_full_path = os.path.join(rom_path, rom)
-                            if not tadpole_functions.addThumbnail(rom_full_path, drive, system, newThumbnailPath, ovewrite):
-                                failedConversions += 1
-                msgBox.showProgress(i, True)
+            failedConversions += tadpole_functions.addThumbnails(romThumbnails, drive, system, ovewrite,
+                                                                 lambda done, total: msgBox.showProgress(done, True))
         
         else:
         #User wants to download romart from internet
@@ -592,7 +634,7 @@ the thumbnail for you. ")
             msgBox.setText("Downloading thumbnails...")
             msgBox.show()
 
-            zip_files = os.scandir(os.path.join(drive,system))
+            zip_files = frogtool.drive_index.entries(os.path.join(drive,system))
             zip_files = list(filter(frogtool.check_zip, zip_files))
             msgBox.setText("Trying to find thumbnails for " + str(len(zip_files)) + " ROMs\n" + ROMArt_console[system])
             msgBox.progress.reset()
@@ -611,7 +653,7 @@ the thumbnail for you. ")
             for i, newThumbnail in enumerate(png_files):
                 newThumbnailName = os.path.splitext(newThumbnail)[0]
                 #Only copy images over from the list
-                if newThumbnail.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
+                if "image" in frogtool.classify_file(newThumbnail):
                     for rom in romList:
                         newThumbnailPath = os.path.join(rom_path, newThumbnail)
                         romName = os.path.splitext(rom)[0]
@@ -798,7 +840,13 @@ from tzlion on frogtool. Special thanks also goes to wikkiewikkie & Jason Grieve
                 return
             if tadpole_functions.addThumbnail(rom_path, drive, system, newLogoFileName, True):
                 QMessageBox.about(self, "Change ROM Logo", "ROM thumbnails successfully changed")
-                RunFrogTool(drive,system)
+                #Zips and raw ROMs are replaced by a .z** file, a .z** of any system keeps its name
+                oldFilename = os.path.basename(rom_path)
+                newFilename = f"{os.path.splitext(oldFilename)[0]}.{frogtool.zxx_ext[system]}"
+                if "zxx" not in frogtool.classify_file(oldFilename):
+                    UpdateFrogToolIndex(drive, system, renamed=[(oldFilename, newFilename)])
+                else:
+                    self.loadROMsToTable()
                 return True
             else:
                 QMessageBox.about(self, "Change ROM Cover", "Unable to convert thumbnail for ROM")
@@ -869,7 +917,9 @@ from tzlion on frogtool. Special thanks also goes to wikkiewikkie & Jason Grieve
         ret = qm.question(self,'Delete ROM?', "Are you sure you want to delete " + rom_path +" and rebuild the ROM list? " , qm.Yes | qm.No)
         if ret == qm.Yes:
             try:
-                tadpole_functions.deleteROM(rom_path)
+                if tadpole_functions.deleteROM(rom_path):
+                    UpdateFrogToolIndex(drive, console, removed=[os.path.basename(rom_path)])
+                    return
             except Exception:
                 QMessageBox.about(self, "Error","Could not delete file.")
             RunFrogTool(drive,console)
@@ -1108,7 +1158,9 @@ This process is only tested on Windows and will not work on Linux/Mac.\n\nDo you
         else:
             QMessageBox.about(self, "Failure", "Something went wrong while trying to change the Boot logo")
             status = True
-        os.remove(bootlogo_file)
+        # a failed download may not have left a file behind
+        if os.path.exists(bootlogo_file):
+            os.remove(bootlogo_file)
         return status
     
     def rebuildAll(self):
@@ -1161,6 +1213,7 @@ It is recommended to save it somewhere other than your SD card used with the SF2
             msgBox.progress.setMaximum(len(filenames)+1)
             msgBox.show()
             QApplication.processEvents()
+            addedFilenames = []
             for filename in filenames:
                 games_copied += 1
                 msgBox.showProgress(games_copied, True)
@@ -1170,22 +1223,29 @@ It is recommended to save it somewhere other than your SD card used with the SF2
                         #Arcade needs the zip file in the /bin folder and we create the ZFB for it
                         if console == 'ARCADE':
                             consolePath = os.path.join(drive, console, 'bin')
-                            #Arcade also needs up to create the ZFB as its just the thumbnail + filename
-                            tadpole_functions.createZFBFile(drive, '', filename)
                         else:
                             consolePath = os.path.join(drive, console)
                         shutil.copy(filename, consolePath)
+                        frogtool.drive_index.invalidate(consolePath)
+                        if console == 'ARCADE':
+                            #Arcade also needs up to create the ZFB as its just the thumbnail + filename
+                            if not tadpole_functions.createZFBFile(drive, '', filename):
+                                logging.error(f"Can't create the ZFB for {filename}")
+                                continue
+                            addedFilenames.append(os.path.splitext(os.path.basename(filename))[0] + '.zfb')
+                        else:
+                            addedFilenames.append(os.path.basename(filename))
                         print (filename + " added to " + consolePath)
                 except Exception as e:
-                    logging.error("Can't copy because {e}")
+                    logging.error(f"Can't copy because {e}")
                     continue
             msgBox.close()
+            UpdateFrogToolIndex(drive, console, added=addedFilenames)
             qm = QMessageBox
             ret = qm.question(self,'Add Thumbnails?', f"Added " + str(len(filenames)) + " ROMs to " + consolePath + "\n\nDo you want to add thumbnails?\n\n\
 Note: You can change in settings to either pick your own or try to downlad automatically.", qm.Yes | qm.No)
             if ret == qm.Yes:
                 self.addBoxart()
-        RunFrogTool(drive,console)
             
     def stripAllShortcutText(self):
         drive = self.combobox_drive.currentText()
@@ -1232,17 +1292,20 @@ Note: You can change in settings to either pick your own or try to downlad autom
         if ret == qm.No:
             return
         result = False
+        deletedFilenames = []
         for item in self.tbl_gamelist.selectedItems():
             try:
                 objGame = self.ROMList[item.row()]
                 result = tadpole_functions.deleteROM(objGame.ROMlocation)
+                if result:
+                    deletedFilenames.append(os.path.basename(objGame.ROMlocation))
             except Exception:
                 result = False
         if result: 
             QMessageBox.about(self, "Success",f"Successfully deleted all selected ROMs.")
         else:
             QMessageBox.about(self, "Error","An error occurred while trying to delete the ROMs. PLease check the log file.")
-        RunFrogTool(drive,console)
+        UpdateFrogToolIndex(drive, console, removed=deletedFilenames)
 
     def copyUserSelectedDirectoryButton(self):
         source_directory = self.combobox_drive.currentText()
@@ -1283,25 +1346,26 @@ Note: You can change in settings to either pick your own or try to downlad autom
             return
         roms_path = os.path.join(drive, system)
         try:
-            files = frogtool.getROMList(roms_path)
+            entries = frogtool.getROMEntries(roms_path)
             self.ROMList = []
             msgBox.progress.reset()
-            msgBox.progress.setMaximum(len(files))
+            msgBox.progress.setMaximum(len(entries))
             msgBox.show()
             QApplication.processEvents()
             #Disable signals from firing from these changes
             self.tbl_gamelist.cellChanged.disconnect(self.catchTableCellChanged)
-            self.tbl_gamelist.setRowCount(len(files))
-            logging.info(f"Found {len(files)} ROMs")
+            self.tbl_gamelist.setRowCount(len(entries))
+            logging.info(f"Found {len(entries)} ROMs")
             start_time = time.perf_counter()
             #sort the list aphabetically before we go through it
-            files = sorted(files)
-            for i,game in enumerate(files):
-                objGame = sf2000ROM(os.path.join(roms_path, game))
+            entries = sorted(entries, key=lambda entry: entry.name)
+            for i,entry in enumerate(entries):
+                game = entry.name
+                objGame = sf2000ROM(entry.path)
                 if objGame.ROMlocation == '':
                     continue
                 self.ROMList.append(objGame)
-                humanReadableFileSize = tadpole_functions.getHumanReadableFileSize(objGame.getFileSize())
+                humanReadableFileSize = tadpole_functions.getHumanReadableFileSize(entry.size)
                 # Filename
                 cell_filename = QTableWidgetItem(f"{objGame.title}")
                 cell_filename.setTextAlignment(Qt.AlignVCenter)
@@ -1322,14 +1386,14 @@ Note: You can change in settings to either pick your own or try to downlad autom
                     cell_viewthumbnail.setTextAlignment(Qt.AlignCenter)
                     #pathToROM = os.path.join(roms_path, game)
                     pathToROM = objGame.ROMlocation
-                    extension = Path(pathToROM).suffix
-                    #only show thumbnails of the .z** files 
-                    sys_zxx_ext = '.' + frogtool.zxx_ext[system]
-                    if(extension == sys_zxx_ext):
-                        with open(pathToROM, "rb") as rom_file:
-                            rom_content = bytearray(rom_file.read(((144*208)*2)))
-                        
-                        img = QImage(rom_content[0:((144*208)*2)], 144, 208, QImage.Format_RGB16) # The byte array length has been left here as a second safety to ensure we dont try to over read.            
+                    #only show thumbnails of the .z** files, and not the blank placeholders
+                    hasThumbnail = False
+                    if frogtool.zxx_category(system) in entry.categories:
+                        with ZXXContainer(pathToROM) as rom:
+                            hasThumbnail = rom.has_real_thumbnail
+                            if hasThumbnail:
+                                img = tadpole_functions.RGB565toQImage(rom.thumbnail_view)
+                    if hasThumbnail:
                         pimg = QPixmap()
                         icon = QIcon()
                         QPixmap.convertFromImage(pimg, img)
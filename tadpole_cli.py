@@ -0,0 +1,186 @@
+"""
+Headless command line for provisioning SF2000 cards without starting the GUI.
+Every command prints a single JSON object to stdout with an "ok" flag, the time taken and the command's results.
+Progress messages from the underlying functions are sent to stderr.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import frogtool
+import tadpole_functions
+import multicore_functions
+import rompack_functions
+
+
+def getBisrvPath(drive):
+    return os.path.join(drive, "bios", "bisrv.asd")
+
+
+def getSystems(system):
+    if not frogtool.check_sys_valid(system):
+        raise tadpole_functions.Exception_InvalidConsole
+    return list(frogtool.systems) if system == "ALL" else [system]
+
+
+def cmdRebuild(args):
+    if args.system == "ALL":
+        results = frogtool.process_all_sys(args.drive, args.check)
+    else:
+        getSystems(args.system)
+        results = {args.system: frogtool.process_sys_timed(args.drive, args.system, args.check)}
+    return not any(result["error"] for result in results.values()), {"systems": results}
+
+
+def cmdAudit(args):
+    results = {}
+    for system in getSystems(args.system):
+        try:
+            results[system] = frogtool.audit_sys(args.drive, system)
+        except (frogtool.StopExecution, OSError, ValueError) as e:
+            results[system] = {"error": str(e) or f"Couldn't audit {system}"}
+    ok = all(isinstance(audits, list) and all(audit["matches"] for audit in audits) for audits in results.values())
+    return ok, {"systems": results}
+
+
+def cmdConvert(args):
+    results = {}
+    for system in getSystems(args.system):
+        roms_path = os.path.join(args.drive, system)
+        if system == "ARCADE" or not os.path.isdir(roms_path):
+            continue
+        start_time = time.perf_counter()
+        if args.overwrite:
+            tadpole_functions.overwriteZXXThumbnail(roms_path, system, imageSource=args.images)
+        converted = frogtool.convert_zip_image_pairs_to_zxx(roms_path, system, image_source=args.images)
+        results[system] = {"converted": converted, "seconds": time.perf_counter() - start_time}
+    return True, {"systems": results}
+
+
+def cmdFirmware(args):
+    version = tadpole_functions.bisrv_getFirmwareVersion(getBisrvPath(args.drive))
+    return bool(version), {"version": version}
+
+
+def cmdBatteryPatch(args):
+    bisrv_path = getBisrvPath(args.drive)
+    version = tadpole_functions.bisrv_getFirmwareVersion(bisrv_path)
+    battery_patcher = tadpole_functions.BatteryPatcher(bisrv_path, version)
+    if battery_patcher.check_patch_applied():
+        return True, {"version": version, "patched": False, "already_patched": True}
+    if version != tadpole_functions.version_displayString_1_6 and \
+            version != tadpole_functions.version_displayString_1_71:
+        return False, {"version": version, "patched": False, "error": "Only v1.6 and v1.71 firmware can be patched"}
+    patched = bool(battery_patcher.patch_firmware())
+    return patched, {"version": version, "patched": patched, "already_patched": False}
+
+
+def cmdBootLogo(args):
+    bisrv_path = getBisrvPath(args.drive)
+    version = tadpole_functions.bisrv_getFirmwareVersion(bisrv_path)
+    if not version:
+        return False, {"version": version, "changed": False, "error": "Only known firmware versions can be changed"}
+    changed = tadpole_functions.changeBootLogo(bisrv_path, args.image)
+    return changed, {"version": version, "changed": changed}
+
+
+def cmdBackupSaves(args):
+    output = args.output or f"SF2000SaveBackup_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+    created = tadpole_functions.createSaveBackup(args.drive, output)
+    return created, {"output": os.path.abspath(output)}
+
+
+def cmdMulticore(args):
+    if args.arcade:
+        romcount = multicore_functions.makeMulticoreROMList_ARCADEMode(args.drive, args.placeholder or "black")
+        # the ARCADE mode list creates .zfb files in the system folders, so their game lists need rebuilding too
+        results = frogtool.process_all_sys(args.drive, False)
+        ok = not any(result["error"] for result in results.values())
+        return ok, {"roms": romcount, "systems": results}
+    return True, {"roms": multicore_functions.makeMulticoreROMList(args.drive)}
+
+
+def cmdPack(args):
+    results = {}
+    for system in getSystems(args.system):
+        roms_path = os.path.join(args.drive, system)
+        # ARCADE only has .zfb files pointing at the zips in ARCADE/bin, which are MAME sets and left as they are
+        if system == "ARCADE" or not os.path.isdir(roms_path):
+            continue
+        start_time = time.perf_counter()
+        summary = rompack_functions.packROMs(roms_path, args.policy)
+        summary["seconds"] = time.perf_counter() - start_time
+        # zipped bare ROMs have new names and repacked files new sizes, so the game list is rebuilt
+        if summary["repacked"]:
+            summary["rebuild"] = frogtool.process_sys_timed(args.drive, system, False)
+        results[system] = summary
+    ok = not any(summary["failed"] or (summary.get("rebuild") or {}).get("error") for summary in results.values())
+    totals = {"bytes_saved": sum(summary["bytes_saved"] for summary in results.values()),
+              "inflate_bytes_delta": sum(summary["inflate_bytes_delta"] for summary in results.values())}
+    return ok, {"systems": results, **totals}
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog="tadpole_cli", description="Headless SF2000 card management")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def addCommand(name, handler, help, system=False):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("drive", help="root of the SD card")
+        if system:
+            command.add_argument("--system", default="ALL", help=f"one of {', '.join(frogtool.systems)} or ALL")
+        command.set_defaults(handler=handler)
+        return command
+
+    rebuild = addCommand("rebuild", cmdRebuild, "rebuild the game lists", system=True)
+    rebuild.add_argument("--check", action="store_true", help="compare the lists on the card without writing")
+    addCommand("audit", cmdAudit, "compare the game lists with the folders without changing anything", system=True)
+    convert = addCommand("convert", cmdConvert, "combine zip + image pairs into .z** files", system=True)
+    convert.add_argument("--overwrite", action="store_true", help="also replace thumbnails of existing .z** files")
+    convert.add_argument("--images", help="folder or zip/tar archive to take the images from instead of the card")
+    addCommand("firmware", cmdFirmware, "detect the firmware version")
+    addCommand("battery-patch", cmdBatteryPatch, "apply the battery patch to the firmware")
+    bootLogo = addCommand("boot-logo", cmdBootLogo, "change the boot logo")
+    bootLogo.add_argument("image", help="image file for the new boot logo")
+    backupSaves = addCommand("backup-saves", cmdBackupSaves, "zip every save file on the card")
+    backupSaves.add_argument("-o", "--output", help="backup zip file to create")
+    multicore = addCommand("multicore", cmdMulticore, "rebuild the multicore ROM lists")
+    multicore.add_argument("--arcade", action="store_true", help="create .zfb files in the system folders instead")
+    multicore.add_argument("--placeholder", help="image to use as the thumbnail of the --arcade .zfb files")
+    pack = addCommand("pack", cmdPack, "recompress the zips of .zip and .z** files, and zip bare ROMs under deflate",
+                      system=True)
+    pack.add_argument("--policy", choices=sorted(rompack_functions.packPolicies), default="stored",
+                      help="stored loads fastest on the device, deflate saves the most space")
+    return parser
+
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.verbose else logging.WARNING)
+    start_time = time.perf_counter()
+    output = {"command": args.command, "drive": args.drive}
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            ok, results = args.handler(args)
+        output.update(results)
+    except tadpole_functions.Exception_InvalidConsole:
+        ok = False
+        output["error"] = f"Invalid system {args.system}"
+    except (tadpole_functions.Exception_InvalidPath, frogtool.StopExecution, OSError) as e:
+        ok = False
+        output["error"] = str(e) or f"Failed running {args.command} on {args.drive}"
+    output["ok"] = bool(ok)
+    output["seconds"] = time.perf_counter() - start_time
+    print(json.dumps(output, indent=2))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -7,10 +7,11 @@ import os
 import shutil
 import hashlib
 import zipfile
+import zlib
 from io import BytesIO
 #feature imports
-import struct
 import frogtool
+from zxxContainer import ZXXContainer
 import requests
 import json
 import logging
@@ -36,9 +37,7 @@ systems = {
     "ARCADE": ["mswb7.tax", "msdtc.nec", "mfpmp.bvs",7]
 }
 
-supported_save_ext = [
-    "sav", "sa0", "sa1", "sa2", "sa3"
-] 
+supported_save_ext = frogtool.supported_save_ext
 
 version_displayString_1_5 = "2023.04.20 (V1.5)"
 version_displayString_1_6 = "2023.08.03 (V1.6)"
@@ -77,16 +76,35 @@ class Exception_StopExecution(Exception):
 class InvalidURLError(Exception):
     pass
    
-def changeBootLogo(index_path, newLogoFileName, msgBox):
+class HeadlessProgress:
+    """Stands in for the progress dialogs and bars when running without a GUI"""
+    def setText(self, text):
+        logging.info(text)
+
+    def showProgress(self, progressValue, refreshBoolean):
+        pass
+
+    def setMaximum(self, maximum):
+        pass
+
+    def setValue(self, value):
+        pass
+
+def changeBootLogo(index_path, newLogoFileName, msgBox=None):
+    if msgBox is None:
+        msgBox = HeadlessProgress()
     # Confirm we arent going to brick the firmware by finding a known version
     sfVersion = bisrv_getFirmwareVersion(index_path)
     print(f"Found Version: {sfVersion}")
-    if sfVersion == None:
+    if not sfVersion:
         return False  
     # Load the new Logo
     msgBox.setText("Uploading new boot logo...")
     msgBox.showProgress(25, True)
     newLogo = QImage(newLogoFileName)
+    if newLogo.isNull():
+        print(f"! Failed opening image file {newLogoFileName} for the boot logo")
+        return False
     # Convert to RGB565
     msgBox.setText("Converting boot logo...")
     msgBox.showProgress(40, True)
@@ -98,12 +116,12 @@ def changeBootLogo(index_path, newLogoFileName, msgBox):
     bisrv_content = bytearray(file_handle.read(os.path.getsize(index_path)))
     file_handle.close()
     logoOffset = findSequence(offset_logo_presequence, bisrv_content,10000000)
+    if logoOffset == -1:
+        print("! Couldn't find the boot logo in the firmware, not changing it")
+        return False
     bootLogoStart = logoOffset + 16
     
-    for i in range(0, 512*200):
-        data = rgb565Data[i].to_bytes(2, 'little')
-        bisrv_content[bootLogoStart+i*2] = data[0]
-        bisrv_content[bootLogoStart+i*2+1] = data[1]
+    memoryview(bisrv_content)[bootLogoStart:bootLogoStart+len(rgb565Data)] = rgb565Data
     msgBox.setText("Updating BIOS file...")
     msgBox.showProgress(80, True)
     print("Patching CRC")    
@@ -118,193 +136,154 @@ def changeBootLogo(index_path, newLogoFileName, msgBox):
     return True
 
 def patchCRC32(bisrv_content):
-    x = crc32mpeg2(bisrv_content[512:len(bisrv_content):1])    
+    x = crc32mpeg2(memoryview(bisrv_content)[512:])
     bisrv_content[0x18c] = x & 255
     bisrv_content[0x18d] = x >> 8 & 255
     bisrv_content[0x18e] = x >> 16 & 255
     bisrv_content[0x18f] = x >> 24
     return bisrv_content
 
+# Maps each byte to its bits in reverse order
+_reverse_bits_table = bytes(int(f"{value:08b}"[::-1], 2) for value in range(256))
+
+def _reflect32(value):
+    return int(f"{value & 0xffffffff:032b}"[::-1], 2)
+
 def crc32mpeg2(buf, crc=0xffffffff):
-    for val in buf:
-        crc ^= val << 24
-        for _ in range(8):
-            crc = crc << 1 if (crc & 0x80000000) == 0 else (crc << 1) ^ 0x104c11db7
-    return crc
+    # CRC-32/MPEG-2 is the zlib CRC-32 with the bits of every byte and of the result reversed, and no final inversion,
+    # so let zlib do the work on a bit reversed copy of the data
+    reflected = zlib.crc32(bytes(buf).translate(_reverse_bits_table), _reflect32(crc) ^ 0xffffffff)
+    return _reflect32(reflected ^ 0xffffffff)
      
 def QImageToRGB565Logo(inputQImage):
     print("Converting supplied file to boot logo format")
     # Need to increase the size to 512x200
     inputQImage = inputQImage.scaled(512, 200, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
     inputQImage = inputQImage.convertToFormat(QImage.Format_RGB16)
-    rgb565Data = []
-    for y in range(0, 200):
-        for x in range(0, 512):
-            pixel = inputQImage.pixelColor(x,y)
-            pxValue = ((pixel.red() & 248) << 8) + ((pixel.green() & 252) << 3) + (pixel.blue() >> 3)
-            rgb565Data.append(pxValue)
+    # Format_RGB16 is little endian RGB565 already, so take the rows straight from the image's bits
+    rowSize = 512 * 2
+    bits = inputQImage.constBits()
+    bits.setsize(inputQImage.bytesPerLine() * 200)
+    bits = bytes(bits)
+    if inputQImage.bytesPerLine() == rowSize:
+        rgb565Data = bits
+    else:
+        rgb565Data = b"".join(bits[y * inputQImage.bytesPerLine():y * inputQImage.bytesPerLine() + rowSize]
+                              for y in range(200))
     print("Finished converting image to boot logo format")
     return rgb565Data   
 
-def changeZIPThumbnail(romPath, newImpagePath, system):
+def changeZIPThumbnail(romPath, newImpagePath, system, thumbnailData=None):
     try:
-        newLogoPath = os.path.dirname(romPath)
-        newLogoName = os.path.basename(newImpagePath)
-        romFile = os.path.basename(romPath)
         new_romPath = os.path.dirname(romPath)
-        newLogoFile = os.path.join(newLogoPath,newLogoName)
-        shutil.copyfile(newImpagePath, newLogoFile)
+        romFile = os.path.basename(romPath)
         sys_zxx_ext = frogtool.zxx_ext[system]
         zxx_file_name = f"{frogtool.strip_file_extension(romFile)}.{sys_zxx_ext}"
         zxx_file_path = os.path.join(new_romPath,zxx_file_name)
-        converted = frogtool.rgb565_convert(newLogoFile, zxx_file_path, (144, 208))
+        if thumbnailData is None:
+            converted = frogtool.rgb565_convert(newImpagePath, zxx_file_path, (144, 208))
+        else:
+            converted = frogtool.write_thumbnail_file(zxx_file_path, thumbnailData)
         if not converted:
             return False
-        zxx_file_handle = open(zxx_file_path, "ab")
-        zip_file_handle = open(romPath, "rb")
-        zxx_file_handle.write(zip_file_handle.read())
-        zxx_file_handle.close()
-        zip_file_handle.close()
+        with open(romPath, "rb") as zip_file_handle, open(zxx_file_path, "r+b") as zxx_file_handle:
+            frogtool.append_file_data(zip_file_handle, zxx_file_handle)
     except Exception as e:
         print(f"! Failed changing zip file")
         logging.error("Could not change thumbnail" + str(e))
         return False
 
+    return removeThumbnailSources(romPath, newImpagePath, zxx_file_name)
+
+#Bare ROMs are deflated straight into the .z** file, no zip of the ROM is written to the card on the way
+def changeRawROMThumbnail(romPath, newImpagePath, system, thumbnailData=None):
+    if thumbnailData is None:
+        thumbnailData = getImageData565(newImpagePath, (144, 208))
+        if not thumbnailData:
+            return False
+    romFile = os.path.basename(romPath)
+    zxx_file_name = f"{frogtool.strip_file_extension(romFile)}.{frogtool.zxx_ext[system]}"
+    if not frogtool.write_rom_to_zxx(romPath, os.path.join(os.path.dirname(romPath), zxx_file_name), thumbnailData):
+        return False
+    return removeThumbnailSources(romPath, newImpagePath, zxx_file_name)
+
+#Removes the ROM that has been packed into a .z** file, and its image if it was in the ROM folder
+def removeThumbnailSources(romPath, newImpagePath, zxx_file_name):
+    romFolder = os.path.dirname(romPath)
     try:
-        os.remove(newLogoFile)
+        #Images that were put in the ROM folder (like downloaded art) are used up, images from elsewhere are left alone
+        if not isinstance(newImpagePath, frogtool.ArchiveImage) and \
+                os.path.normcase(os.path.abspath(os.path.dirname(newImpagePath))) == \
+                os.path.normcase(os.path.abspath(romFolder)):
+            os.remove(newImpagePath)
         os.remove(romPath)
     except (OSError, IOError):
         print(f"! Failed deleting source file(s) after creating {zxx_file_name}")
         return False
+    finally:
+        frogtool.drive_index.invalidate(romFolder)
 
     return True
 
-def changeZXXThumbnail(romPath, imagePath):
-    tempPath = f"{romPath}.tmp"
-    converted = frogtool.rgb565_convert(imagePath, tempPath, (144, 208))
-    if not converted:
-        return False
-    # copy the rom data to the temp
-    try:
-        temp_file_handle = open(tempPath, "ab")
-        zxx_file_handle = open(romPath, "rb")
-        romData = bytearray(zxx_file_handle.read())
-        temp_file_handle.write(romData[59904:])
-        temp_file_handle.close()
-        zxx_file_handle.close()
-    except (OSError, IOError):
-        print(f"! Failed appending zip file to ")
-        return False
-    try:
-        shutil.move(tempPath,romPath)
-    except (OSError, IOError) as error:
-        print(f"! Failed moving temp files. {error}")
-        return False
-    return True
-
-def overwriteZXXThumbnail(roms_path, system, progress):
+def changeZXXThumbnail(romPath, imagePath, thumbnailData=None):
+    if thumbnailData is None:
+        thumbnailData = getImageData565(imagePath, (144, 208))
+        if not thumbnailData:
+            return False
+    #Only the thumbnail at the start of the file changes, so write it in place rather than copying the whole ROM
+    return frogtool.write_zxx_thumbnail(romPath, thumbnailData)
+
+#Replaces the thumbnails of .z** files with the images of the same name, from roms_path or from imageSource (a folder
+#or a zip/tar archive of images, read in place)
+def overwriteZXXThumbnail(roms_path, system, progress=None, imageSource=None):
+    if progress is None:
+        progress = HeadlessProgress()
+    #Finish any thumbnail rewrites an earlier run didn't get to complete
+    frogtool.recover_zxx_thumbnails(roms_path)
     #First we need to get lists of all the images and ROMS
-    img_files = os.scandir(roms_path)
-    img_files = list(filter(frogtool.check_img, img_files))
-    rom_files = os.scandir(roms_path)
-    rom_files = list(filter(frogtool.check_rom, rom_files))
+    files = frogtool.drive_index.entries(roms_path)
+    if imageSource is None:
+        img_files = list(filter(frogtool.check_img, files))
+    else:
+        img_files = frogtool.list_thumbnail_images(imageSource)
+    #Only .z** files have a thumbnail to overwrite
+    zxx_files = [file for file in files if frogtool.check_file(file, "zxx")]
     sys_zxx_ext = frogtool.zxx_ext[system]
-    if not img_files or not rom_files:
+    if not img_files or not zxx_files:
         return
     print(f"Found image and .z** files, looking for matches to combine to {sys_zxx_ext}")
-
-    #SECOND we need to get the RAW copies of each image...if there is a matching Z**
-    imgs_processed = 0
-    progress.setMaximum(len(img_files))
-    progress.setValue(imgs_processed)
-    for img_file in img_files:
-        zxx_rom_file = frogtool.find_matching_file_diff_ext(img_file, rom_files)
-        if not zxx_rom_file:
-            continue
-        tempPath = f"{zxx_rom_file.path}.tmp"
-        converted = frogtool.rgb565_convert(img_file.path, tempPath, (144, 208))
-        if not converted:
-            print("! Aborting image processing due to errors")
-            break
-        try:
-            temp_file_handle = open(tempPath, "ab")
-            zxx_file_handle = open(zxx_rom_file.path, "rb")
-            romData = bytearray(zxx_file_handle.read())
-            temp_file_handle.write(romData[59904:])
-            temp_file_handle.close()
-            zxx_file_handle.close()
-        except (OSError, IOError):
-            print(f"! Failed appending zip file to ")
-            break
-        try:
-            shutil.move(tempPath,zxx_rom_file.path)
-        except (OSError, IOError) as error:
-            print(f"! Failed moving temp files. {error}")
-            break
-        imgs_processed += 1
-        progress.setValue(imgs_processed)
+    #If a name has several .z** files, prefer this system's one
+    zxx_priority = [sys_zxx_ext] + sorted(set(frogtool.zxx_ext.values()) - {sys_zxx_ext})
+    zxx_index = frogtool.index_files_by_stem(zxx_files, zxx_priority, ".z** files")
+    img_index = frogtool.index_files_by_stem(img_files, frogtool.supported_img_ext, "images")
+    pairs = [(frogtool.thumbnail_source(img_file), zxx_index[stem])
+             for stem, img_file in img_index.items() if stem in zxx_index]
+
+    #SECOND we convert the images in the background and write each new thumbnail over the start of its Z**
+    def writeThumbnail(zxx_rom_file, thumbnailData):
+        return changeZXXThumbnail(zxx_rom_file.path, None, thumbnailData)
+
+    def showProgress(done, total):
+        progress.setValue(done)
         QApplication.processEvents()
-    #Third we need to copy the data of the new thumbnail over to the rom file
-
-"""
-This is a rewrtite attempt at changing the cover art inplace rather thancopy and replace
-"""
-# def changeZXXThumbnail2(romPath, imagePath):
-#     coverData = getImageData565(imagePath, (144, 208))
-#     if not coverData:
-#         return False
-#     # copy the rom data to the temp
-#     try:
-#         zxx_file_handle = open(romPath, "r+b")
-#         zxx_file_handle.seek(0)
-#         zxx_file_handle.write(coverData)
-#         zxx_file_handle.close()
-#     except (OSError, IOError):
-#         print(f"! Failed appending zip file to ")
-#         return False
-#     return True
 
+    progress.setMaximum(len(pairs))
+    progress.setValue(0)
+    imgs_processed, failed = frogtool.convert_thumbnail_batch(pairs, writeThumbnail, progress_callback=showProgress)
+    frogtool.drive_index.invalidate(roms_path)
+    return imgs_processed
 
 def getImageData565(src_filename, dest_size=None):
     if not image_lib_avail:
         print("! Pillow module not found, can't do image conversion")
         return False
     try:
-        srcimage = Image.open(src_filename)
+        #TODO: let user decide to stretch or not
+        return frogtool.encode_thumbnail_file(src_filename, dest_size)
     except (OSError, IOError):
         print(f"! Failed opening image file {src_filename} for conversion")
         return False
 
-    # convert the image to RGB if it was not already
-    image = Image.new('RGB', srcimage.size, (0, 0, 0))
-    image.paste(srcimage, None)
-
-    if dest_size and image.size != dest_size:
-        #TODO: let user decide to stretch or not
-        maxsize = (144, 208)
-        image = image.thumbnail(maxsize, Image.ANTIALIAS) 
-
-    image_height = image.size[1]
-    image_width = image.size[0]
-    pixels = image.load()
-
-    if not pixels:
-        print(f"! Failed to load image from {src_filename}")
-        return False
-    rgb565Data = []
-    for h in range(image_height):
-        for w in range(image_width):
-            pixel = pixels[w, h]
-            if not type(pixel) is tuple:
-                print(f"! Unexpected pixel type at {w}x{h} from {src_filename}")
-                return False
-            r = pixel[0] >> 3
-            g = pixel[1] >> 2
-            b = pixel[2] >> 3
-            rgb = (r << 11) | (g << 5) | b
-            rgb565Data.append(struct.pack('H', rgb))
-    return rgb565Data
-
 def bisrv_getFirmwareVersion(index_path):
     print(f"trying to read {index_path}")
     try:
@@ -325,8 +304,7 @@ def bisrv_getFirmwareVersion(index_path):
         print(f"finished finding logo - ({badExceptionOffset})")
         if (badExceptionOffset > -1):  # Check we found the boot logo position
             bootLogoStart = badExceptionOffset + 16
-            for i in range(bootLogoStart, bootLogoStart + 204800):
-                bisrv_content[i] = 0x00
+            bisrv_content[bootLogoStart:bootLogoStart + 204800] = bytes(204800)
         else:  # If no boot logo found exit
             return False
         
@@ -583,23 +561,8 @@ def getPrefixFromConsole(console):
         return 6 #Aracde NEEDS 6 so always default to that
 
 def findSequence(needle, haystack, offset = 0):
-    # Loop through the data array starting from the offset
-    for i in range(len(haystack) - offset - len(needle) + 1):
-        readpoint = offset + i
-        # Assume a match until proven otherwise
-        match = True
-        # Loop through the target sequence and compare each byte
-        for j in range(len(needle)):
-            if haystack[readpoint + j] != needle[j]:
-                # Mismatch found, break the inner loop and continue the outer loop
-                match = False
-                break
-        # If match is still true after the inner loop, we have found a match
-        if match:
-            # Return the index of the first byte of the match
-            return readpoint
-    # If we reach this point, no match was found
-    return -1
+    # Returns the index of the first match of the needle bytes from the offset onwards, or -1 if there is no match
+    return haystack.find(bytes(needle), offset)
     
 
     
@@ -812,6 +775,7 @@ def downloadFileFromGithub(outFile, url):
             with open(outFile, 'wb') as f:
                 print(f'downloading {url} to {outFile}')
                 f.write(response.content)
+            frogtool.drive_index.invalidate_file(outFile)
             return True
         else:
             print("Error when trying to download a file from Github. Response was not code 200")
@@ -920,62 +884,37 @@ def emptyHistory(drive) -> bool:
 # then there's four null bytes, then there's the name of a .zip file with no path (presumably /ARCADE/bin/ is hardcoded), and then finally two null bytes 
 def extractFileNameFromZFB(romFilePath):
     try:
-        with open(romFilePath, "rb") as rom_file:
-            #get past the RAW image
-            rom_file.seek(59908)
-            #need to now go until we find the null bytes
-            rom_file_end = rom_file.read()
-            rom_name_content = bytearray()
-            i = 0
-            while i < len(rom_file_end):
-                if rom_file_end[i] == 0x00 and rom_file_end[i+1] == 0x00:
-                    break
-                rom_name_content.append(rom_file_end[i])
-                i += 1
-            #rom_content = bytearray(rom_file.read(907))
-            fileName = rom_name_content.decode()
-            logging.info(f"({fileName}) decoded from ZFB")
-            return fileName
+        with ZXXContainer(romFilePath) as zfb:
+            fileName = zfb.zfb_target or ''
+        logging.info(f"({fileName}) decoded from ZFB")
+        return fileName
     except Exception as e:
         logging.error(f"tadpole_functions~extractFileNameFromZFB: error {str(e)}")
         return ''
 
 #Thanks DTeyn for the code!: https://github.com/Dteyn/ZFBTool/blob/master/ZFBTool.pyw
-def createZFBFile(drive, pngPath, romPath):
+def createZFBFile(drive, pngPath, romPath, placeholder="fill"):
     """Creates a .ZFB file with input .PNG file and ARCADE ROM .ZIP name"""
     # Define the size of the thumbnail
     thumb_size = (144, 208)
     try:
-        #if its blank, just give it 1's as raw data for the first bytes
+        #if its blank, use the cached placeholder thumbnail (1's as raw data unless another is picked)
         if pngPath == '': 
-            raw_data_bytes = bytes(b'\x01' * 59904)
+            raw_data_bytes = frogtool.get_placeholder_thumbnail(placeholder)
+            if raw_data_bytes is None:
+                return False
         else:
-            with Image.open(pngPath) as img:
-                img = img.resize(thumb_size)
-                img = img.convert("RGB")
-                raw_data = []
-                # Convert image to RGB565
-                for y in range(thumb_size[1]):
-                    for x in range(thumb_size[0]):
-                        r, g, b = img.getpixel((x, y))
-                        rgb = ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
-                        raw_data.append(struct.pack('H', rgb))
-                raw_data_bytes = b''.join(raw_data)
+            # Stretch the image to the thumbnail size and convert it to RGB565, or reuse the cached conversion
+            raw_data_bytes = frogtool.encode_thumbnail_file(pngPath, thumb_size, crop=False)
+            frogtool.thumbnail_cache.trim()
         # Create .zfb filename
         ZIPName = os.path.basename(romPath)
         ROMName = os.path.splitext(ZIPName)[0]
         zfb_file = os.path.join(drive, 'ARCADE', ROMName + '.zfb')
         
         # Now we write the entire ZFB file
-        with open(zfb_file, 'wb') as zfb:
-            # Write the image data to the .zfb file
-            zfb.write(raw_data_bytes)
-            # Write four 00 bytes
-            zfb.write(b'\x00\x00\x00\x00')
-            # Write the ROM filename
-            zfb.write(ZIPName.encode())
-            # Write two 00 bytes
-            zfb.write(b'\x00\x00')
+        if not frogtool.write_zfb_file(zfb_file, ZIPName, raw_data_bytes):
+            return False
         logging.info(f"ZFB file created successfully.")
         return True
     except Exception as e:
@@ -1002,15 +941,31 @@ def deleteROM(ROMfilePath):
     except:
         logging.error(f"ERROR: tadpole_functions~deleteROM: failed to delete provided ROM file ({ROMfilePath})") 
         return False   
+    finally:
+        frogtool.drive_index.invalidate_file(ROMfilePath)
     return True          
           
 
 def extractImgFromROM(romFilePath, outfilePath):
-    with open(romFilePath, "rb") as rom_file:
-
-        rom_content = bytearray(rom_file.read())
-        img = QImage(rom_content[0:((144*208)*2)], 144, 208, QImage.Format_RGB16)
-        img.save(outfilePath)
+    with ZXXContainer(romFilePath) as rom:
+        image = frogtool.rgb565_to_image(rom.thumbnail_view, (144, 208))
+    image.save(outfilePath)
+
+def RGB565toQImage(data, width=144, height=208):
+    """Decodes RGB565 data into a QImage that keeps its own copy of the pixels, missing pixels are left black"""
+    data_size = width * height * 2
+    data = bytes(data[:data_size]).ljust(data_size, b"\0")
+    return QImage(data, width, height, width * 2, QImage.Format_RGB16).copy()
+
+def readRGB565QImage(path, width=144, height=208):
+    """Loads the RGB565 image at the start of a file, such as a .raw boot logo"""
+    with open(path, "rb") as file:
+        return RGB565toQImage(file.read(width * height * 2), width, height)
+
+def readZXXThumbnailQImage(path):
+    """Loads the thumbnail of a .z** or .zfb file"""
+    with ZXXContainer(path) as rom:
+        return RGB565toQImage(rom.thumbnail_view)
 
         
 def GBABIOSFix(drive: str):
@@ -1048,19 +1003,12 @@ def stripShortcutText(drive: str):
         raise Exception_InvalidPath
     gakne_path = os.path.join(drive, "Resources", "gakne.ctp")
     try:
-        gakne = open(gakne_path, "rb")
-        data = bytearray(gakne.read())
-        gakne.close()
         # Gakne is made up of 8 rows of 4 items for a total of 32 items.
         # Each image is 144 x 32. Total image size 576 x 256.
-        # To only strip the shortcut text we want to leave the settings menu items. So we have to skip the first 18,432 bytes
-        
-        for i in range (18432, len(data)):
-            data[i-1] = 0x00
-        gakne = open(gakne_path, "wb")
-        gakne.write(data)
-        gakne.close()
-        return True
+        # To only strip the shortcut text we want to leave the settings menu items, which are the first row of 32 pixels
+        shortcutText = openBRGAasImage(gakne_path)
+        shortcutText.paste((0, 0, 0, 0), (0, 32, shortcutText.width, shortcutText.height))
+        return writeImagetoBGRAfile(shortcutText, gakne_path)
     except (OSError, IOError) as e:
         print(f"! Failed striping shortcut labels. {e}")
         return False
@@ -1082,8 +1030,7 @@ def updateShortcutTextforConsole(drive: str, console: int, game1:str, game2:str,
     try:
         # Gakne is made up of 8 rows of 4 items for a total of 32 items.
         # Each image is 144 x 32. Total image size 576 x 256.
-        # To only strip the shortcut text we want to leave the settings menu items. So we have to skip the first 18,432 bytes
-        # Console order: FC, SFC, MD, GB, GBC, GBA, ARCADE
+        # The first row is the settings menu items, then one row per console in this order: FC, SFC, MD, GB, GBC, GBA, ARCADE
         newText = [game1,game2,game3,game4]
         shortcutText = openBRGAasImage(gakne_path)
         replaceMask = Image.new("RGBA", (144, 32), (255, 255, 255, 255))
@@ -1094,58 +1041,27 @@ def updateShortcutTextforConsole(drive: str, console: int, game1:str, game2:str,
             ImageDraw.Draw(img_g).text((72,16), newText[i], (255,255,255),font=fnt, anchor="mm")        
             shortcutText.paste(img_g, (144*i,(console+1)*32), replaceMask)
 
-        shortcutText.save("C:\\Users\\OEM\\Documents\\test.png")
-        # TODO XXXXXX
-        writeImagetoBGRAfile(shortcutText, gakne_path)
-        return True
+        return writeImagetoBGRAfile(shortcutText, gakne_path)
     except (OSError, IOError) as e:
         print(f"! Failed updating shortcut labels. {e}")
         return False
 
-def openBRGAasImage(inputFile):
+# gakne.ctp is stored as 32 bit pixels in B, G, R, A byte order, 576 pixels wide
+gakne_width = 576
+
+def openBRGAasImage(inputFile, width=gakne_width):
     # Read the binary data
     with open(inputFile, 'rb') as file:
         data = file.read()
-    # Unpack the BGRA8888 data
-    pixels = struct.unpack('>' + ('L' * (len(data) // 4)), data)
-    # Convert the BGRA8888 values to RGBA888 format
-    rgba8888_pixels = [
-            ((pixel & 0x0000FF00) >> 8, (pixel & 0x00FF0000) >> 16, (pixel & 0xFF000000) >> 24, (pixel & 0x000000FF))
-            for pixel in pixels
-    ]
-    # Create an image from the pixels
-    width = 576  # Specify the width of the image
-    height = len(rgba8888_pixels) // width
-    image = Image.new('RGBA', (width, height))
-    image.putdata(rgba8888_pixels)
-    return image
-
-#TODO why is it all coming out yellow???
+    # Create an RGBA image straight from the BGRA8888 data
+    height = len(data) // (width * 4)
+    return Image.frombytes('RGBA', (width, height), data[:width * height * 4], 'raw', 'BGRA')
+
 def writeImagetoBGRAfile(image:Image, outfile:str):
     try:
-        dest_file = open(outfile, "wb")
-        image_height = image.size[1]
-        image_width = image.size[0]
-        pixels = image.load()
-
-        if not pixels:
-            logging.error(f"tadpole_functions~writeImagetoBGRAfile: Failed to load image")
-            return False
-        data = []
-        for h in range(image_height):
-            for w in range(image_width):
-                pixel = pixels[w, h]
-                if not type(pixel) is tuple:
-                    logging.error(f"! Unexpected pixel type at {w}x{h} from {outfile}")
-                    return False
-                r = pixel[0]
-                g = pixel[1]
-                b = pixel[2]
-                a = pixel[3]
-                bgra = (b) | (g << 16) | (r << 8) | (a << 24)
-                data.append(struct.pack('>L', bgra))
-        dest_file.write(b''.join(data))
-        dest_file.close()
+        data = image.convert('RGBA').tobytes('raw', 'BGRA')
+        with open(outfile, "wb") as dest_file:
+            dest_file.write(data)
         return True
     except (OSError, IOError):
         logging.error(f"tadpole_functions~writeImagetoBGRAfile: Failed opening image file {outfile} for conversion")
@@ -1174,10 +1090,7 @@ def createSaveBackup(drive: str, zip_file_name):
         return False
                      
 def check_is_save_file(filename):
-    for ext in supported_save_ext:
-        if filename.lower().endswith(ext):
-            return True
-    return False
+    return "save" in frogtool.classify_file(filename)
         
 def getHumanReadableFileSize(filesize):
     humanReadableFileSize = "ERROR"          
@@ -1194,18 +1107,10 @@ def convertRGB565toPNG(inputFile):
         # Read the binary data
         with open(inputFile, 'rb') as file:
             data = file.read()
-        # Unpack the RGB565 data
-        pixels = struct.unpack('<' + ('H' * (len(data) // 2)), data)
-        # Convert the RGB565 values to RGB888 format
-        rgb888_pixels = [
-            ((pixel & 0xF800) >> 8, (pixel & 0x07E0) >> 3, (pixel & 0x001F) << 3)
-            for pixel in pixels
-        ]
-        # Create an image from the pixels
+        # Create an image from the RGB565 data
         width = 640  # Specify the width of the image
-        height = len(rgb888_pixels) // width
-        image = Image.new('RGB', (width, height))
-        image.putdata(rgb888_pixels)
+        height = len(data) // (width * 2)
+        image = frogtool.rgb565_to_image(data, (width, height))
         # Save the image as PNG
         image.save('currentBackground.temp.png')
         return image
@@ -1279,42 +1184,54 @@ def zip_file(file_path, output_path):
     file_name = os.path.basename(file_path)
     with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
         zipf.write(file_path, arcname=file_name)
+    frogtool.drive_index.invalidate_file(output_path)
 
 #Add a thumbnail to a single rom
-def addThumbnail(rom_path, drive, system, new_thumbnail, ovewrite):
+def addThumbnail(rom_path, drive, system, new_thumbnail, ovewrite, thumbnailData=None):
         try:
             #Check if this rom type is supported
             romFullName = os.path.basename(rom_path)
-            romName, romExtension = os.path.splitext(romFullName)
-            #Strip the . as frogtool doesn't use it in its statics
-            romExtension = romExtension.lstrip('.')
+            romCategories = frogtool.classify_file(romFullName)
             sys_zxx_ext = frogtool.zxx_ext[system]
             #If its not supported, return
-            if romExtension not in frogtool.supported_rom_ext:
+            if "rom" not in romCategories:
                 return False
             #If its zip pass to frogtool
-            elif romExtension in frogtool.supported_zip_ext:
-                if not changeZIPThumbnail(rom_path, new_thumbnail, system):
+            elif "zip" in romCategories:
+                if not changeZIPThumbnail(rom_path, new_thumbnail, system, thumbnailData):
                     return False
             #If its the supported system .z** pass to frogtool
-            elif romExtension in frogtool.zxx_ext.values():
+            elif "zxx" in romCategories:
                 if ovewrite == True:
-                    if not changeZXXThumbnail(rom_path, new_thumbnail):
+                    if not changeZXXThumbnail(rom_path, new_thumbnail, thumbnailData):
                         return False
-            #Finally that means its supported but not zip, let's zip it up
+            #Finally that means its supported but not zip, zip it up into the .z** as it's written
             else:
-                new_zipped_rom_path = os.path.join(drive, system, romName + '.zip')
-                zip_file(rom_path, new_zipped_rom_path)
-                if not changeZIPThumbnail(new_zipped_rom_path, new_thumbnail, system): 
+                if not changeRawROMThumbnail(rom_path, new_thumbnail, system, thumbnailData):
                     return False
-                #Frogtool takes care of the zip, we need to remove the base ROM to not confuse the user
-                if os.path.exists(rom_path):
-                    os.remove(rom_path)
             return True
         except Exception_InvalidPath:
             #QMessageBox.about(window, "Change ROM Cover", "An error occurred.")
             return False
 
+#Add thumbnails to a batch of roms, rom_thumbnails is a list of (rom path, thumbnail path or ArchiveImage) pairs
+#The images are converted in the background and the failures are counted rather than stopping the batch
+def addThumbnails(rom_thumbnails, drive, system, ovewrite, progress_callback=None):
+    items = []
+    for rom_path, new_thumbnail in rom_thumbnails:
+        romCategories = frogtool.classify_file(os.path.basename(rom_path))
+        #.z** files keep their thumbnail unless the user wants them overwritten, so skip converting for them
+        if "zxx" in romCategories and not ovewrite:
+            continue
+        items.append((new_thumbnail, (rom_path, new_thumbnail)))
+
+    def writeThumbnail(rom_thumbnail, thumbnailData):
+        rom_path, new_thumbnail = rom_thumbnail
+        return addThumbnail(rom_path, drive, system, new_thumbnail, ovewrite, thumbnailData)
+
+    converted, failed = frogtool.convert_thumbnail_batch(items, writeThumbnail, progress_callback=progress_callback)
+    return len(failed)
+
 #Thanks to Dteyn for putting the python together from here: https://github.com/Dteyn/SF2000_Battery_Level_Patcher/blob/master/main.py
 #Thanks to OpenAI for writing the class and converting logging to prints
 class BatteryPatcher:
@@ -1378,22 +1295,10 @@ class BatteryPatcher:
 
     def calculate_crc32(self, data):
         """
-        Calculate the CRC32 value for the given data. 
-        Credit to @bnister for the C version of this code (translated to Python by GPT-4)
+        Calculate the CRC32 value for the given data, everything after the 512 byte header.
+        This is the same CRC-32/MPEG-2 the boot logo patch uses.
         """
-        tab_crc32 = [(i << 24) & 0xFFFFFFFF for i in range(256)]
-        for i in range(256):
-            c = tab_crc32[i]
-            for _ in range(8):
-                c = (c << 1) ^ 0x4c11db7 if (c & (1 << 31)) else c << 1
-                c &= 0xFFFFFFFF
-            tab_crc32[i] = c
-
-        c = ~0 & 0xFFFFFFFF
-        for i in range(512, len(data)):
-            c = (c << 8) ^ tab_crc32[((c >> 24) ^ data[i]) & 0xFF]
-            c &= 0xFFFFFFFF
-        return c
+        return crc32mpeg2(memoryview(data)[512:])
 
     def check_patch_applied(self):
         with open(self.firmware_file, 'rb') as f:
@@ -1439,10 +1344,12 @@ class BatteryPatcher:
         logging.info("The firmware matched the expected firmware versions at offset %X." %addr)
         return True
 
-    def patch_firmware(self, progressIndicator):
+    def patch_firmware(self, progressIndicator=None):
         """
         Patch the firmware file with new battery values and update its CRC32.
         """
+        if progressIndicator is None:
+            progressIndicator = HeadlessProgress()
         try:
             progressIndicator.setValue(1)
             QApplication.processEvents()
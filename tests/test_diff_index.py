@@ -0,0 +1,41 @@
+import frogtool
+
+
+def diff_filenames(existing_filenames, fresh_filenames):
+    # diffs of the three index files of a system, the second and third list Game.zip and Game.zgb both as Game
+    return [frogtool.diff_index(frogtool.IndexFile(existing), frogtool.IndexFile(fresh))
+            for existing, fresh in zip(frogtool.build_sys_indexes(existing_filenames),
+                                       frogtool.build_sys_indexes(fresh_filenames))]
+
+
+def test_repeated_names_match_themselves():
+    filenames = ["Game.zip", "Game.zgb", "Other.zip", "Game (USA).zip"]
+    for diff in diff_filenames(filenames, filenames):
+        assert diff["matches"]
+        assert diff["missing"] == diff["extra"] == diff["reordered"] == []
+
+
+def test_repeated_name_missing_once():
+    diffs = diff_filenames(["Game.zip", "Other.zip"], ["Game.zip", "Game.zgb", "Other.zip"])
+    assert diffs[0]["missing"] == ["Game.zgb"]
+    for diff in diffs[1:]:
+        assert not diff["matches"]
+        assert diff["missing"] == ["Game"]
+        assert diff["extra"] == diff["reordered"] == []
+
+
+def test_repeated_name_extra_once():
+    diffs = diff_filenames(["Game.zip", "Game.zgb", "Other.zip"], ["Game.zip", "Other.zip"])
+    for diff in diffs[1:]:
+        assert diff["extra"] == ["Game"]
+        assert diff["missing"] == diff["reordered"] == []
+
+
+def test_reordered_name():
+    existing = frogtool.IndexFile(frogtool.build_index_content({"a.zip": "a", "b.zip": "b", "c.zip": "c"},
+                                                               lambda names: ["b", "a", "c"]))
+    fresh = frogtool.IndexFile(frogtool.build_index_content({"a.zip": "a", "b.zip": "b", "c.zip": "c"},
+                                                            frogtool.sort_normal))
+    diff = frogtool.diff_index(existing, fresh)
+    assert not diff["matches"]
+    assert diff["reordered"] in (["a"], ["b"])
@@ -0,0 +1,37 @@
+import os
+import random
+
+import tadpole_functions
+
+gakne_size = tadpole_functions.gakne_width * 256 * 4
+# the first row of icons, the settings menu items, is 32 pixels high
+kept_size = tadpole_functions.gakne_width * 32 * 4
+
+
+def random_gakne(path):
+    data = random.Random(2048).randbytes(gakne_size)
+    path.write_bytes(data)
+    return data
+
+
+def test_bgra_round_trip_is_byte_exact(tmp_path):
+    source_path = tmp_path / "gakne.ctp"
+    data = random_gakne(source_path)
+    image = tadpole_functions.openBRGAasImage(str(source_path))
+    assert image.size == (tadpole_functions.gakne_width, 256)
+
+    output_path = tmp_path / "gakne_out.ctp"
+    assert tadpole_functions.writeImagetoBGRAfile(image, str(output_path))
+    assert output_path.read_bytes() == data
+
+
+def test_strip_shortcut_text_keeps_the_settings_row(tmp_path):
+    os.mkdir(tmp_path / "Resources")
+    gakne_path = tmp_path / "Resources" / "gakne.ctp"
+    data = random_gakne(gakne_path)
+
+    assert tadpole_functions.stripShortcutText(str(tmp_path))
+    stripped = gakne_path.read_bytes()
+    assert len(stripped) == gakne_size
+    assert stripped[:kept_size] == data[:kept_size]
+    assert stripped[kept_size:] == bytes(gakne_size - kept_size)
@@ -0,0 +1,64 @@
+import frogtool
+
+
+def build_index_content_by_concatenation(name_map, sort_func):
+    # the original builder, which grew the names and pointers by concatenating bytes
+    sorted_filenames = sorted(name_map.keys())
+    names_bytes = b""
+    pointers_by_name = {}
+    for filename in sorted_filenames:
+        display_name = name_map[filename]
+        pointers_by_name[display_name] = len(names_bytes)
+        names_bytes += display_name.encode('utf-8') + chr(0).encode('utf-8')
+
+    metadata_bytes = frogtool.int_to_4_bytes_reverse(len(name_map))
+    for name in sort_func(name_map.values()):
+        metadata_bytes += frogtool.int_to_4_bytes_reverse(pointers_by_name[name])
+    return metadata_bytes + names_bytes
+
+
+def index_name_maps(filenames):
+    # the three maps process_sys builds for a system's index files
+    stripped_names = list(map(frogtool.strip_file_extension, filenames))
+    return [
+        (dict(zip(filenames, filenames)), frogtool.sort_without_file_ext),
+        (dict(zip(filenames, stripped_names)), frogtool.sort_normal),
+        (dict(zip(filenames, stripped_names)), frogtool.sort_normal),
+    ]
+
+
+def assert_matches_concatenation(filenames):
+    for name_map, sort_func in index_name_maps(filenames):
+        assert frogtool.build_index_content(name_map, sort_func) == \
+            build_index_content_by_concatenation(name_map, sort_func)
+
+
+def test_empty_list():
+    assert_matches_concatenation([])
+    assert frogtool.build_index_content({}, frogtool.sort_normal) == b"\x00\x00\x00\x00"
+
+
+def test_plain_names():
+    assert_matches_concatenation(["Zelda.zgb", "Advance Wars.zip", "mario.gba", "Metroid.zgb", "b.c.d.zip"])
+
+
+def test_unicode_names():
+    assert_matches_concatenation(["ポケモン 赤.zgb", "Pokémon Émeraude.zip", "슈퍼마리오.sfc", "Ōkami ü.zsf",
+                                  "🐸 frog.nes", "Ångström.zip"])
+
+
+def test_stems_that_collide_once_the_extension_is_stripped():
+    filenames = ["Game.zip", "Game.zgb", "Game.gba", "Game (USA).zip", "Other.zfc", "Other.nes", "ポケモン.zip",
+                 "ポケモン.zgb"]
+    assert_matches_concatenation(filenames)
+
+
+def test_many_names():
+    filenames = [f"Game {index:05} ロム.{ext}" for index in range(2000) for ext in ("zip", "zgb")]
+    assert_matches_concatenation(filenames)
+
+
+def test_layout():
+    content = frogtool.build_index_content({"b.zip": "b", "a.zip": "a"}, frogtool.sort_normal)
+    # the count, the pointers in display order, then the names in filename order each ending in a null
+    assert content == b"\x02\x00\x00\x00" + b"\x00\x00\x00\x00" + b"\x02\x00\x00\x00" + b"a\x00b\x00"
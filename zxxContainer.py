@@ -0,0 +1,106 @@
+import mmap
+import os
+import frogtool
+
+# A .z** ROM is the thumbnail followed by the ROM zip. A .zfb arcade shortcut is the thumbnail, four zero bytes, then
+# the name of the zip in ARCADE/bin and two zero bytes
+zip_local_header = b"PK\x03\x04"
+zip_end_header = b"PK\x05\x06"
+# the end of central directory record is 22 bytes plus a comment of up to 65535 bytes
+zip_end_search_size = 22 + 65535
+
+
+class ZXXContainer():
+    """
+    Opens a .z** or .zfb file with mmap so the thumbnail, the ROM data or the .zfb target can be read without loading
+    the file. The views are slices of the mapping rather than copies, they stop working once the container is closed,
+    so copy anything that has to outlive it. Use it in a with block so the file is closed (and unlocked on Windows).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            # an empty file can't be mapped, it just has no thumbnail or payload
+            if os.fstat(self._file.fileno()).st_size:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._map = b""
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        self._view = memoryview(self._map)
+        self._views = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._map)
+
+    def close(self):
+        # the mapping can only be closed once every view into it has been released
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self._view.release()
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def _slice(self, start, end=None):
+        view = self._view[start:end]
+        self._views.append(view)
+        return view
+
+    @property
+    def is_zfb(self):
+        return frogtool.get_file_ext(os.path.basename(self.path)) == "zfb"
+
+    @property
+    def thumbnail_view(self):
+        """The RGB565 thumbnail, shorter than thumbnail_data_size if the file is cut short"""
+        return self._slice(0, frogtool.thumbnail_data_size)
+
+    @property
+    def payload_view(self):
+        """The ROM zip after the thumbnail of a .z** file, None for a .zfb which only names its zip"""
+        if self.is_zfb:
+            return None
+        return self._slice(frogtool.thumbnail_data_size)
+
+    @property
+    def zfb_target(self):
+        """The name of the zip in ARCADE/bin that a .zfb loads, None if the file is too short to have one"""
+        start = frogtool.thumbnail_data_size + len(frogtool.zfb_separator)
+        if len(self._map) < start:
+            return None
+        end = self._map.find(frogtool.zfb_terminator, start)
+        if end == -1:
+            end = len(self._map)
+        return self._map[start:end].decode()
+
+    @property
+    def has_real_thumbnail(self):
+        """False if the thumbnail is cut short or is the black or fill placeholder"""
+        size = frogtool.thumbnail_data_size
+        if len(self._map) < size:
+            return False
+        with self._view[:size] as thumbnail:
+            return all(thumbnail != frogtool.placeholder_thumbnails[placeholder] for placeholder in ("black", "fill"))
+
+    @property
+    def payload_is_zip(self):
+        """
+        A quick check that the data after the thumbnail looks like a whole zip, it starts with a zip entry (or is an
+        empty zip) and the end of the zip's directory is there, without reading the rest of it
+        """
+        start = frogtool.thumbnail_data_size
+        if self.is_zfb or len(self._map) < start + len(zip_end_header):
+            return False
+        if self._map[start:start + 4] not in (zip_local_header, zip_end_header):
+            return False
+        return self._map.rfind(zip_end_header, max(start, len(self._map) - zip_end_search_size)) != -1